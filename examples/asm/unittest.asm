@@ -1,6 +1,6 @@
 ; Unit tests for ENG1448 processor
 ; When successful, halts at instruction 254, showing 0b01010101
-; When unsuccessful, halts at instruction 255, showing test number (1-38)
+; When unsuccessful, halts at instruction 255, showing test number (1-39)
 
        .macro setled
        mov  r12, $0
@@ -299,6 +299,15 @@ br1:   setled 38
        b    pc, 1
        b    @err
 
+; Carry flag set by bit-wise operation with constant bit above 8
+cbit1: setled 39
+       shl  r11, r10, 1
+       orr  r11, r5, 9
+       bcs  @err
+       shl  r11, r10, 1
+       eor  r11, r5, 10
+       bcs  @err
+
        b    @succ
 
        .org 0xFC
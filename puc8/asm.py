@@ -4,29 +4,78 @@
    (c) 2020-2023 Wouter Caarls, PUC-Rio
 """
 
-import sys, argparse
+import sys, codecs, argparse
 
 from .assembler import Preprocessor, Assembler
 from .simulator import Simulator
-from .emitter import emitvhdl
+from .jit import JITSimulator
+from .devices import headless
+from .profiler import Profile
+from .trace import TraceWriter
+from .emitter import emitvhdl, emitmap, emitlisting, emitimage
 
 def main():
     parser = argparse.ArgumentParser(description='PUC8 Assembler (c) 2020-2023 Wouter Caarls, PUC-Rio')
-    parser.add_argument('file', type=str,
-                        help='ASM source file')
+    parser.add_argument('file', type=str, nargs='+',
+                        help='ASM source file (several with --batch)')
     parser.add_argument('-o', '--output', type=str,
                         help='Output file', default='-')
     parser.add_argument('-s', '--simulate', action='store_true',
                         help='Simulate resulting program')
     parser.add_argument('-t', '--test', metavar='N', type=int,
-                        help='Simulate for 1000 steps and check whether PC == N')
+                        help='Simulate until halted and check whether PC == N')
+    parser.add_argument('--steps', metavar='N', type=int,
+                        help='Maximum number of simulation steps', default=1000)
+    parser.add_argument('--jit', action='store_true',
+                        help='Translate basic blocks when testing')
+    parser.add_argument('--input', metavar='TEXT', type=str,
+                        help='Scripted keyboard input for simulation')
+    parser.add_argument('-p', '--profile', action='store_true',
+                        help='Print execution profile after simulation')
+    parser.add_argument('--trace', metavar='FILE', type=str,
+                        help='Record execution trace (.gz, .bz2 or .xz to compress)')
+    parser.add_argument('--map', metavar='FILE', type=str,
+                        help='Write symbol table to FILE')
+    parser.add_argument('--listing', metavar='FILE', type=str,
+                        help='Write listing of machine code and source to FILE')
+    parser.add_argument('--rom', metavar='FILE', type=str,
+                        help='Write code memory image to FILE (.hex, .bin, .coe or .mem)')
+    parser.add_argument('--ram', metavar='FILE', type=str,
+                        help='Write data memory image to FILE (.hex, .bin, .coe or .mem)')
     parser.add_argument('-E', action='store_true',
                         help='Output preprocessed assembly code')
+    parser.add_argument('--cache', metavar='DIR', type=str,
+                        help='Cache preprocessed source files in DIR')
+    parser.add_argument('-b', '--batch', action='store_true',
+                        help='Assemble all files in parallel, writing a VHDL package per file to the OUTPUT directory')
+    parser.add_argument('-j', '--jobs', metavar='N', type=int,
+                        help='Number of parallel jobs with --batch (default: number of CPUs)')
 
     args = parser.parse_args()
 
-    pp  = Preprocessor()
-    asm = pp.process(args.file)
+    if args.batch:
+        # Options that only make sense for a single file
+        single = [('-s', args.simulate), ('-t', args.test is not None), ('--jit', args.jit),
+                  ('--input', args.input is not None), ('-p', args.profile),
+                  ('--trace', args.trace is not None), ('--map', args.map is not None),
+                  ('--listing', args.listing is not None), ('--rom', args.rom is not None),
+                  ('--ram', args.ram is not None), ('-E', args.E)]
+        for option, given in single:
+            if given:
+                parser.error(f'{option} cannot be used with --batch')
+
+        # Batch mode is rare, and the process pool takes a while to import
+        from .batch import run
+        try:
+            failed = run(args.file, args.output if args.output != '-' else None, args.jobs, args.cache)
+        except ValueError as e:
+            parser.error(str(e))
+        sys.exit(1 if failed else 0)
+    if len(args.file) > 1:
+        parser.error('assembling more than one file requires --batch')
+
+    pp  = Preprocessor(args.cache)
+    asm = pp.process(args.file[0])
 
     if args.output != '-':
         f = open(args.output, 'w')
@@ -35,20 +84,48 @@ def main():
 
     if args.E:
         # Don't emit machine code, just preprocessed assembly.
-        for (idx, label, inst) in asm:
+        for (idx, label, inst, _, _, _) in asm:
             print(idx + ' ' + (label + ': ' if label != '' else '') + inst, file=f)
     else:
         ass = Assembler()
         mem = ass.process(asm)
 
-        if args.simulate or args.test:
-            sim = Simulator()
-            if args.simulate:
-                sim.process(mem)
-            else:
-                pc = sim.run(mem, 1000)
-                if pc != args.test:
-                    raise RuntimeError('PC after 1000 steps is ' + str(pc) + ', expected ' + str(args.test))
+        if args.map is not None:
+            with open(args.map, 'w') as f2:
+                emitmap(mem, f2)
+        if args.listing is not None:
+            with open(args.listing, 'w') as f2:
+                emitlisting(mem, f2)
+        if args.rom is not None:
+            emitimage(mem, 'code', args.rom)
+        if args.ram is not None:
+            emitimage(mem, 'data', args.ram)
+
+        if args.simulate or args.test is not None:
+            devices = None
+            if args.test is not None or args.input is not None:
+                # Never block on the keyboard when testing
+                devices = headless(codecs.decode(args.input or '', 'unicode_escape'), echo=True)
+            sim = JITSimulator(mem.symbols, devices) if args.jit else Simulator(mem.symbols, devices)
+            if args.profile:
+                sim.profile = Profile()
+            if args.trace is not None:
+                sim.trace = TraceWriter(args.trace)
+            try:
+                if args.simulate:
+                    sim.process(mem)
+                    if args.profile:
+                        sim.profile.report(sim)
+                else:
+                    res = sim.simulate(mem, args.steps)
+                    if args.profile:
+                        sim.profile.report(sim)
+                    pc = res.state.regs[15]
+                    if pc != args.test:
+                        raise RuntimeError('PC after ' + str(res.cycles) + ' steps is ' + str(pc) + ', expected ' + str(args.test))
+            finally:
+                if sim.trace is not None:
+                    sim.trace.close()
         else:
             emitvhdl(mem, f)
 
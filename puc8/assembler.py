@@ -2,18 +2,25 @@
 (c) 2020-2023 Wouter Caarls, PUC-Rio
 """
 
-import sys, os, string, math, re
+import sys, os, string, math, re, hashlib, marshal
+from collections import namedtuple
 from .instructions import defs
+from .image import Image
 
-def _split(s, delim=r'\s'):
-    """https://stackoverflow.com/questions/16710076/python-split-a-string-respect-and-preserve-quotes"""
-    return re.findall('(?:[^' + delim + r'"]|"(?:\\.|[^"])*")+', s)
+# Split on whitespace or commas, respecting string quotations. See
+# https://stackoverflow.com/questions/16710076/python-split-a-string-respect-and-preserve-quotes
+_tokens = re.compile(r'(?:[^\s"]|"(?:\\.|[^"])*")+')
+_operands = re.compile(r'(?:[^,"]|"(?:\\.|[^"])*")+')
+
+# Tokenised line of normalized assembly. Operand kinds are given as a
+# signature string (see kind).
+Line = namedtuple('Line', ['idx', 'label', 'inst', 'mnemonic', 'operands', 'kinds'])
 
 def split(s):
     """Splits an instruction into the mnemonic and its operands, respecting string quotations"""
-    tokens = _split(s)
+    tokens = _tokens.findall(s)
     mnemonic = tokens[0]
-    operands = _split(''.join(tokens[1:]), ',')
+    operands = _operands.findall(''.join(tokens[1:]))
 
     # Translate MNM Rd, [rR, C] into MNM Rd, [rR], C
     if len(operands) == 3:
@@ -37,13 +44,70 @@ def split(s):
             operands[i] = '[r13]'
     return mnemonic, operands
 
+def parse(idx, label, inst):
+    """Tokenises a normalized instruction into a Line."""
+    if inst == '':
+        return Line(idx, label, inst, '', (), '')
+    mnemonic, operands = split(inst)
+    return Line(idx, label, inst, mnemonic, tuple(operands), ''.join(map(kind, operands)))
+
+# Macro arguments ($n) and local label uses (@_label)
+_slots = re.compile(r'(\$.|@_[^\s\]]*)')
+
+def _template(inst):
+    """Pre-parses an instruction in a macro body into a format string with
+    argument slots ({n}) and local label suffix slots ({s}), and the
+    argument numbers it uses. Returns None if nothing needs to be substituted."""
+    if '$' not in inst and '@_' not in inst:
+        return None
+
+    fmt = ''
+    args = []
+    for i, part in enumerate(_slots.split(inst)):
+        part = part.replace('{', '{{').replace('}', '}}')
+        if i % 2 == 0:
+            fmt += part
+        elif part[0] == '$':
+            args.append(ord(part[1])-ord('0'))
+            fmt += f'{{{max(args[-1], 0)}}}'
+        else:
+            fmt += part + '{s}'
+    return fmt, args
+
+def _substitute(template, operands, suffix, mnemonic):
+    """Instantiates a macro body instruction template."""
+    fmt, args = template
+    for arg in args:
+        if arg < 0 or arg >= len(operands):
+            raise SyntaxError(f'Invalid argument ${arg} in call to macro {mnemonic}')
+    return fmt.format(*operands, s=suffix)
+
+def _drain(gen, out):
+    """Appends everything a generator yields to a list and returns its return value."""
+    while True:
+        try:
+            out.append(next(gen))
+        except StopIteration as e:
+            return e.value
+
+# Version of the preprocessed file cache format
+CACHE_VERSION = 2
+
 class Preprocessor:
-    """Assembly preprocessor."""
+    """Assembly preprocessor.
+
+    If a cache directory is given, the preprocessed contents of every file
+    are stored there, keyed by the file name, its contents and the macro
+    environment. A cached file is reused as long as it and all files it
+    includes are unchanged."""
+    def __init__(self, cache=None):
+        self.cache = cache
+        self.deps = {}
+
     def process(self, file):
         """Preprocesses the source, resolving .include and .macro directives,
-        and normalizing the instructions."""
-        asm, _ = self._preprocess(file)
-        return self._reindex(asm)
+        and normalizing and tokenising the instructions into Lines."""
+        return self._reindex(list(self._preprocess(file)))
 
     def _normalize(self, line):
         """Strips comments and lowers uppercase characters."""
@@ -62,36 +126,86 @@ class Preprocessor:
             return ('',line)
 
     def _preprocess(self, file, macros={}):
-        """Resolves .include and .macro directives, and splits .db directives into single bytes."""
+        """Reads a file (or file object) and lazily yields its preprocessed
+        lines, using the cache if available. Returns the defined macros."""
+        if not isinstance(file, str):
+            try:
+                return (yield from self._expand('<stdin>', '.', file, macros))
+            finally:
+                file.close()
+
+        if self.cache is None:
+            with open(file, 'r') as f:
+                return (yield from self._expand(file, os.path.dirname(file), f, macros))
+
+        with open(file, 'r') as f:
+            text = f.read()
+
+        digest = hashlib.sha256(text.encode()).hexdigest()
+        key = hashlib.sha256(repr((CACHE_VERSION, file, digest, sorted(macros.items()))).encode()).hexdigest()
+        path = os.path.join(self.cache, key + '.bin')
+
+        try:
+            with open(path, 'rb') as f:
+                deps, asm, macros2 = marshal.load(f)
+            if all(self._digest(dep) == d for dep, d in deps.items()):
+                self.deps.update(deps)
+                yield from asm
+                return macros2
+        except (OSError, EOFError, ValueError, TypeError):
+            pass
+
+        # Collect digests of this file and all files it includes
+        outer = self.deps
+        self.deps = {file: digest}
         asm = []
+        try:
+            gen = self._expand(file, os.path.dirname(file), text.split('\n'), macros)
+            while True:
+                try:
+                    line = next(gen)
+                except StopIteration as e:
+                    macros2 = e.value
+                    break
+                asm.append(line)
+                yield line
+            deps = self.deps
+        finally:
+            self.deps = outer
+        outer.update(deps)
+
+        try:
+            os.makedirs(self.cache, exist_ok=True)
+            with open(path + '.tmp', 'wb') as f:
+                marshal.dump((deps, asm, macros2), f)
+            os.replace(path + '.tmp', path)
+        except OSError:
+            pass
+
+        return macros2
+
+    def _digest(self, file):
+        """Returns the hash of a file's contents, or None if it cannot be read."""
+        try:
+            with open(file, 'r') as f:
+                return hashlib.sha256(f.read().encode()).hexdigest()
+        except OSError:
+            return None
+
+    def _expand(self, file, dir, lines, macros):
+        """Resolves .include and .macro directives, and splits .db directives
+        into single bytes. Yields the resulting lines and returns the defined
+        macros."""
         macros = macros.copy()
         macro = ''
         nonce = 0
 
-        if isinstance(file, str):
-            dir = os.path.dirname(file)
-            f = open(file, 'r')
-        else:
-            dir = '.'
-            f = file
-            file = '<stdin>'
-
-        for idx, line in enumerate(f.readlines()):
-            idx = idx + 1
-
-            if macro == '':
-                # Emit into main instruction stream
-                code = asm
-            else:
-                # Currently processing a macro; emit into that.
-                code = macros[macro]
-
+        for idx, line in enumerate(lines, 1):
             (label, inst) = self._splitlabel(self._normalize(line))
 
             if inst != '':
                 mnemonic, operands = split(inst)
-                if len(operands) > 0:
-                    o = operands[0]
+                o = operands[0] if len(operands) > 0 else ''
 
                 if mnemonic == '.include':
                     # Include other assembly file.
@@ -99,24 +213,31 @@ class Preprocessor:
                         raise SyntaxError(f'{file}:{idx:3}: Expected string constant')
                     if len(o) < 3 or (o[0] != '"' and o[0] != '\'') or (o[-1] != '"' and o[-1] != '\''):
                         raise SyntaxError(f'{file}:{idx:3}: Malformed string constant {o}')
+                    code = []
                     if label != '':
-                        code.append((file, idx, label, ''))
-                    asm2, macros2 = self._preprocess(os.path.join(dir, o[1:-1]))
-                    for line2 in asm2:
-                        code.append(line2)
+                        code.append((file, idx, label, '', '', ()))
+                    include = self._preprocess(os.path.join(dir, o[1:-1]))
+                    if macro == '':
+                        # Stream into main instruction stream
+                        yield from code
+                        code = []
+                        macros2 = yield from include
+                    else:
+                        macros2 = _drain(include, code)
                     macros.update(macros2)
                 elif mnemonic == '.db':
                     # Split .db into single-byte constants
+                    code = []
                     tmp = label
                     for o in operands:
                         if o[0] == r'"':
                             if len(o) < 3 or o[-1] != r'"':
                                 raise SyntaxError(f'{file}:{idx:3}: Malformed string constant')
                             for c in o[1:-1]:
-                                code.append((file, idx, tmp, r'.db "' + c + r'"'))
+                                code.append((file, idx, tmp, r'.db "' + c + r'"', '.db', ('"' + c + '"',)))
                                 tmp = ''
                         else:
-                            code.append((file, idx, tmp, '.db ' + o))
+                            code.append((file, idx, tmp, '.db ' + o, '.db', (o,)))
                             tmp = ''
                 elif mnemonic == '.macro':
                     # Create a new macro.
@@ -130,49 +251,43 @@ class Preprocessor:
                         raise SyntaxError(f'{file}:{idx:3}: Redefinition of macro {o}')
                     macro = o
                     macros[macro] = []
+                    continue
                 elif mnemonic == '.endmacro':
                     # Macro finished.
                     macro = ''
+                    continue
                 elif mnemonic in macros:
-                    # Macro call. Emit macro contents into main instruction stream.
+                    # Macro call. Substitute arguments and local labels into macro contents.
+                    code = []
                     if label != '':
-                        code.append((file, idx, label, ''))
+                        code.append((file, idx, label, '', '', ()))
 
-                    for (file2, idx2, label2, inst2) in macros[mnemonic]:
-                        newinst = ''
-                        ii = 0
+                    suffix = str(nonce) + '_'
+                    for (file2, idx2, label2, inst2, mnemonic2, operands2, template) in macros[mnemonic]:
                         if label2 != '' and label2[0] == '_':
                             # Make label definition local
-                            label2 = label2 + str(nonce) + '_'
-                        while ii < len(inst2):
-                            if inst2[ii] == '$' and ii < len(inst2)-1:
-                                # Resolve macro argument
-                                arg = ord(inst2[ii+1])-ord('0');
-                                if arg >= 0 and arg < len(operands):
-                                    newinst = newinst + operands[arg]
-                                    ii += 2
-                                else:
-                                    raise SyntaxError(f'Invalid argument ${arg} in call to macro {mnemonic}')
-                            elif inst2[ii] == '@' and ii < len(inst2)-1 and inst2[ii+1] == '_':
-                                # Make label use local
-                                while ii < len(inst2) and not inst2[ii].isspace() and inst2[ii] != ']':
-                                    newinst = newinst + inst2[ii]
-                                    ii += 1
-                                newinst = newinst + str(nonce) + '_'
-                            else:
-                                newinst = newinst + inst2[ii]
-                                ii += 1
-
-                        code.append((file2, idx2, label2, newinst))
+                            label2 = label2 + suffix
+                        if template is not None:
+                            inst2 = _substitute(template, operands, suffix, mnemonic)
+                            mnemonic2, operands2 = split(inst2)
+                            operands2 = tuple(operands2)
+                        code.append((file2, idx2, label2, inst2, mnemonic2, operands2))
                     nonce += 1
                 else:
-                    code.append((file, idx, label, inst))
+                    code = [(file, idx, label, inst, mnemonic, tuple(operands))]
             elif label != '':
-                code.append((file, idx, label, inst))
+                code = [(file, idx, label, inst, '', ())]
+            else:
+                continue
 
-        f.close()
+            if macro == '':
+                # Emit into main instruction stream
+                yield from code
+            else:
+                # Currently processing a macro; emit into that.
+                macros[macro].extend(line + (_template(line[3]),) for line in code)
 
-        return asm, macros
+        return macros
 
     def _reindex(self, asm):
         """Combines file and line numbers into a single string."""
@@ -186,34 +301,79 @@ class Preprocessor:
 
         ret = []
         for a in asm:
-            ret.append((f'{a[0]:>{midx}}:{a[1]:>{ml}}', a[2], a[3]))
+            ret.append(Line(f'{a[0]:>{midx}}:{a[1]:>{ml}}', a[2], a[3], a[4], a[5], ''.join(map(kind, a[5]))))
         return ret
 
+def kind(o):
+    """Classifies an operand as register (R), register address (A),
+    constant address (B) or constant (C)."""
+    if len(o) > 1 and o[0] == '[' and o[-1] == ']':
+        return 'A' if _isreg(o[1:-1]) else 'B'
+    return 'R' if _isreg(o) else 'C'
+
+def _isreg(o):
+    return len(o) > 1 and o[0] == 'r' and o[1:].isdigit()
+
+def signature(req):
+    """Returns the operand kind signature of an instruction pattern."""
+    return ''.join('C' if r == '4' or r == '8' else r for r in req)
+
+Encoding = namedtuple('Encoding', ['req', 'base', 'shifts'])
+
+def _encoding(opcode, minor, req):
+    """Precomputes the fixed bits of an instruction pattern and the
+    position of each operand."""
+    if opcode == '':
+        return Encoding(req, None, ())
+
+    shifts = []
+    pos = 17 - len(opcode)
+    for r in req:
+        pos -= 8 if r == '8' or r == 'B' else 4
+        shifts.append(pos)
+    return Encoding(req, int(opcode, 2) << (17 - len(opcode)) | int(minor or '0', 2), tuple(shifts))
+
+# Instruction encodings indexed by mnemonic and operand kind signature
+encodings = {(mnemonic, signature(req)): _encoding(opcode, minor, req)
+             for mnemonic in defs for (opcode, minor, req) in defs[mnemonic]}
+
 class Assembler:
     """Assembler for normalized assembly."""
     def process(self, asm):
-        """Emits machine code for normalized assembly."""
-        labels = self._pass1(asm)
-        return self._pass2(asm, labels)
+        """Emits machine code image for normalized assembly, given as Lines
+        or (idx, label, inst) tuples."""
+        asm = [line if isinstance(line, Line) else parse(*line) for line in asm]
+        labels, sections = self._pass1(asm)
+        mem = self._pass2(asm, labels)
+
+        # Symbol table
+        for label, value in labels.items():
+            section = sections.get(label)
+            mem.labels[label] = (section, value)
+            if section in mem.symbols:
+                mem.symbols[section].setdefault(value, label)
+
+        return mem
 
     def _pass1(self, lines):
-        """Calculates label locations."""
+        """Calculates label locations, and the section of every label that
+        is not an .equ constant."""
         section = 'code'
         labels = {}
+        sections = {}
         loc = {'code': 0, 'data': 0}
 
-        for (idx, label, inst) in lines:
+        for (idx, label, inst, mnemonic, operands, kinds) in lines:
             if label != '':
                 if label in labels:
                     raise SyntaxError(f'{idx}: Redefinition of label {label}')
 
                 labels[label] = loc[section]
+                sections[label] = section
 
             if inst == '':
                 continue
 
-            mnemonic, operands = split(inst)
-
             if mnemonic == '.org':
                 if len(operands) < 1:
                     raise SyntaxError(f'{idx}: {mnemonic} directive requires an address argument')
@@ -241,76 +401,85 @@ class Assembler:
             else:
                 loc[section] += 1
 
-        return labels
+        return labels, sections
 
-    def _resolve(self, lidx, mnemonic, operands, labels):
-        """Resolves instruction operands."""
+    def _resolve(self, lidx, mnemonic, operands, kinds, labels):
+        """Resolves instruction operands, returning the encoded instruction
+        word (None for directives) and the operand values."""
         if not mnemonic in defs:
             raise SyntaxError(f"{lidx}: Unrecognized mnemonic '{mnemonic}'")
 
-        for (opcode, minor, req) in defs[mnemonic]:
-            try:
-                if len(operands) != len(req):
-                    raise SyntaxError(f'{lidx}: {mnemonic} requires {len(req)} operand(s), found {operands}')
-
-                ret = []
-                for r, o in zip(req, operands):
-                    if r == 'R' or r == 'A':
-                        if r == 'A':
-                            # Register address
-                            if len(o) < 4 or o[0] != '[' or o[-1] != ']':
-                                raise SyntaxError(f"{lidx}: {mnemonic} operand '{o}' is not a valid indirect memory request")
-                            o = o[1:-1]
-
-                        # Register
-                        if len(o) < 2 or o[0] != 'r' or int(o[1:]) < 0 or int(o[1:]) > 15:
-                            raise SyntaxError(f"{lidx}: {mnemonic} operand '{o}' is not a valid register")
-                        ret.append(f'{int(o[1:]):04b}')
-                    elif r == '4' or r == '8' or r == 'B':
-                        if r == 'B':
-                            # Constant address
-                            if len(o) < 2 or o[0] != '[' or o[-1] != ']':
-                                raise SyntaxError(f"{lidx}: {mnemonic} operand '{o}' is not a valid direct memory request")
-                            o = o[1:-1]
-
-                        # Constant or label evaluated as constant
-                        if len(o) > 1 and o[0] == '@':
-                            if o[1:] in labels:
-                                if r == '4':
-                                    ret.append(f'{labels[o[1:]]:04b}')
-                                else:
-                                    ret.append(f'{labels[o[1:]]:08b}')
-                            else:
-                                raise ValueError(f"{lidx}: label '{o}' not defined")
-                        elif r != '4' and len(o) == 3 and o[0] == r'"' and o[-1] == r'"':
-                            ret.append(f'{ord(o[1]):08b}')
-                        else:
-                            try:
-                                val = int(o, 0)
-                            except:
-                                raise SyntaxError(f"{lidx}: {mnemonic} operand '{o}' is not a valid constant")
-                            if r == '4':
-                                if val < -8 or val > 15:
-                                    raise ValueError(f"{lidx}: {mnemonic} operand '{o}' is not a valid 4-bit signed or unsigned constant")
-                                if val < 0:
-                                     val = 16+val
-                                ret.append(f'{val:04b}')
-                            else:
-                                if val < -128 or val > 255:
-                                    raise ValueError(f"{lidx}: {mnemonic} operand '{o}' is not a valid 8-bit signed or unsigned constant")
-                                if val < 0:
-                                    val = 256+val
-                                ret.append(f'{val:08b}')
-                    else:
-                        ret.append(o)
-                return opcode, minor, ret
-            except Exception as e:
-                lastex = e
-        raise lastex
+        enc = encodings.get((mnemonic, kinds))
+        if enc is None:
+            # Validate against the last encoding with the same number of
+            # operands. This accepts directive arguments of any kind (X),
+            # and raises the appropriate error otherwise
+            same = [(opcode, minor, req) for (opcode, minor, req) in defs[mnemonic] if len(req) == len(operands)]
+            if len(same) == 0:
+                counts = ' or '.join(sorted({str(len(req)) for (_, _, req) in defs[mnemonic]}))
+                raise SyntaxError(f'{lidx}: {mnemonic} requires {counts} operand(s), found {operands}')
+            enc = encodings[(mnemonic, signature(same[-1][2]))]
+
+        ret = [self._operand(lidx, mnemonic, r, o, labels) for r, o in zip(enc.req, operands)]
+
+        if enc.base is None:
+            return None, ret
+
+        word = enc.base
+        for shift, val in zip(enc.shifts, ret):
+            word |= val << shift
+        return word, ret
+
+    def _operand(self, lidx, mnemonic, r, o, labels):
+        """Resolves a single operand of a given kind."""
+        if r == 'R' or r == 'A':
+            if r == 'A':
+                # Register address
+                if len(o) < 4 or o[0] != '[' or o[-1] != ']':
+                    raise SyntaxError(f"{lidx}: {mnemonic} operand '{o}' is not a valid indirect memory request")
+                o = o[1:-1]
+
+            # Register
+            if len(o) < 2 or o[0] != 'r' or not o[1:].isdigit() or int(o[1:]) > 15:
+                raise SyntaxError(f"{lidx}: {mnemonic} operand '{o}' is not a valid register")
+            return int(o[1:])
+        elif r == '4' or r == '8' or r == 'B':
+            if r == 'B':
+                # Constant address
+                if len(o) < 2 or o[0] != '[' or o[-1] != ']':
+                    raise SyntaxError(f"{lidx}: {mnemonic} operand '{o}' is not a valid direct memory request")
+                o = o[1:-1]
+
+            # Constant or label evaluated as constant
+            if len(o) > 1 and o[0] == '@':
+                if o[1:] in labels:
+                    val = labels[o[1:]]
+                else:
+                    raise ValueError(f"{lidx}: label '{o}' not defined")
+            elif r != '4' and len(o) == 3 and o[0] == r'"' and o[-1] == r'"':
+                val = ord(o[1])
+            else:
+                try:
+                    val = int(o, 0)
+                except:
+                    raise SyntaxError(f"{lidx}: {mnemonic} operand '{o}' is not a valid constant")
+            if r == '4':
+                if val < -8 or val > 15:
+                    raise ValueError(f"{lidx}: {mnemonic} operand '{o}' is not a valid 4-bit signed or unsigned constant")
+                if val < 0:
+                     val = 16+val
+            else:
+                if val < -128 or val > 255:
+                    raise ValueError(f"{lidx}: {mnemonic} operand '{o}' is not a valid 8-bit signed or unsigned constant")
+                if val < 0:
+                    val = 256+val
+            return val
+        else:
+            return o
 
     def _pass2(self, lines, labels):
         """Emits machine code."""
-        mem = {'code': [], 'data': []}
+        mem = Image()
         section = 'code'
 
         ls = 0
@@ -318,7 +487,7 @@ class Assembler:
             ls = max(ls, len(l))
 
         ref = ' ' * (ls + 2)
-        for (idx, label, inst) in lines:
+        for (idx, label, inst, mnemonic, operands, kinds) in lines:
             if label != '':
                 ref = f'{label}: ' + ' ' * (ls-len(label))
             else:
@@ -327,8 +496,7 @@ class Assembler:
             if inst == '':
                 continue
 
-            mnemonic, operands = split(inst)
-            opcode, minor, operands = self._resolve(idx, mnemonic, operands, labels)
+            word, operands = self._resolve(idx, mnemonic, operands, kinds, labels)
 
             if mnemonic == '.section':
                 section = operands[0]
@@ -337,23 +505,15 @@ class Assembler:
                 pass
             elif mnemonic == '.org':
                 # Fill memory until requested address
-                while len(mem[section]) < int('0b' + operands[0], 0):
-                    if section == 'code':
-                        mem[section].append(('00000000000000000', ''))
-                    else:
-                        mem[section].append(('00000000', ''))
+                while len(mem.refs[section]) < operands[0]:
+                    mem.append(section, 0)
             elif mnemonic == '.db':
                 # Add byte into instruction stream
-                mem[section].append((operands[0], f'{idx}: {ref}{inst}'))
+                mem.append(section, operands[0], f'{idx}: {ref}{inst}', idx)
             elif section != 'code':
                 raise ValueError(f'{idx}: Cannot use instructions in data section')
             else:
-                instcode = opcode
-                for o in operands:
-                    instcode += o
-                instcode += minor
-
-                mem[section].append((instcode, f'{idx}: {ref}{inst}'))
+                mem.append(section, word, f'{idx}: {ref}{inst}', idx)
 
             ref = ' ' * (ls + 2)
 
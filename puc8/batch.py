@@ -0,0 +1,81 @@
+"""Batch assembler for ENG1448 8-bit processor
+   (c) 2020-2023 Wouter Caarls, PUC-Rio
+"""
+
+import os, sys, time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from .assembler import Preprocessor, Assembler
+from .emitter import emitvhdl
+
+# Outcome of assembling a single file. Either image or error is None.
+Result = namedtuple('Result', ['file', 'image', 'error', 'time'])
+
+def assemble(file, cache=None):
+    """Assembles a single file, returning a Result instead of raising."""
+    start = time.perf_counter()
+    try:
+        image = Assembler().process(Preprocessor(cache).process(file))
+        return Result(file, image, None, time.perf_counter() - start)
+    except Exception as e:
+        return Result(file, None, f'{type(e).__name__}: {e}', time.perf_counter() - start)
+
+def _assemble(args):
+    return assemble(*args)
+
+def assemble_all(files, jobs=None, cache=None):
+    """Assembles a number of files in parallel, returning a Result for each
+    file in the same order. Failures do not affect the other files.
+
+    jobs defaults to the number of CPUs. With a single job, files are
+    assembled in the calling process."""
+    files = list(files)
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = min(jobs, len(files))
+
+    if jobs <= 1:
+        return [assemble(file, cache) for file in files]
+
+    with ProcessPoolExecutor(jobs) as executor:
+        return list(executor.map(_assemble, [(file, cache) for file in files]))
+
+def outputs(files, dir):
+    """Returns the VHDL package file written to dir for every file.
+
+    Packages are named after the source file, so sources with the same
+    name in different directories would overwrite each other's output.
+    This raises a ValueError instead."""
+    names = {}
+    for file in files:
+        name = os.path.join(dir, os.path.splitext(os.path.basename(file))[0] + '.vhdl')
+        if name in names:
+            raise ValueError(f'{file} and {names[name]} would both be written to {name}')
+        names[name] = file
+    return list(names)
+
+def run(files, output=None, jobs=None, cache=None):
+    """Assembles files in parallel, reporting the result and time taken for
+    every file and optionally writing a VHDL package per file to the output
+    directory. Returns the number of files that failed."""
+    files = list(files)
+    names = outputs(files, output) if output is not None else None
+
+    start = time.perf_counter()
+    results = assemble_all(files, jobs, cache)
+
+    failed = 0
+    for idx, res in enumerate(results):
+        if res.error is None:
+            print(f'{res.file}: ok ({res.time*1000:.1f} ms)')
+            if names is not None:
+                os.makedirs(output, exist_ok=True)
+                with open(names[idx], 'w') as f:
+                    emitvhdl(res.image, f)
+        else:
+            print(f'{res.file}: {res.error}', file=sys.stderr)
+            failed += 1
+
+    print(f'{len(results) - failed} of {len(results)} files assembled in {time.perf_counter() - start:.3f}s')
+    return failed
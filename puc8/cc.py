@@ -4,47 +4,113 @@
    (c) 2020-2023 Wouter Caarls, PUC-Rio
 """
 
-import sys, io, argparse
+import sys, io, codecs, argparse
 
-from .compiler import compile
 from .assembler import Preprocessor, Assembler
 from .simulator import Simulator
-from .emitter import emitasm, emitvhdl
+from .jit import JITSimulator
+from .devices import headless
+from .profiler import Profile
+from .trace import TraceWriter
+from .emitter import emitasm, emitvhdl, emitmap, emitlisting, emitimage
 
 def main():
     parser = argparse.ArgumentParser(description='PUC8 C compiler (c) 2020-2023 Wouter Caarls, PUC-Rio')
-    parser.add_argument('file', type=str,
+    parser.add_argument('file', type=str, nargs='?',
                         help='C source file')
     parser.add_argument('-o', '--output', type=str,
                         help='Output file', default='-')
     parser.add_argument('-s', '--simulate', action='store_true',
                         help='Simulate resulting program')
     parser.add_argument('-t', '--test', metavar='N', type=int,
-                        help='Simulate for 1000 steps and check whether PC == N')
+                        help='Simulate until halted and check whether PC == N')
+    parser.add_argument('--steps', metavar='N', type=int,
+                        help='Maximum number of simulation steps', default=1000)
+    parser.add_argument('--jit', action='store_true',
+                        help='Translate basic blocks when testing')
+    parser.add_argument('--input', metavar='TEXT', type=str,
+                        help='Scripted keyboard input for simulation')
+    parser.add_argument('-p', '--profile', action='store_true',
+                        help='Print execution profile after simulation')
+    parser.add_argument('--trace', metavar='FILE', type=str,
+                        help='Record execution trace (.gz, .bz2 or .xz to compress)')
+    parser.add_argument('--map', metavar='FILE', type=str,
+                        help='Write symbol table to FILE')
+    parser.add_argument('--listing', metavar='FILE', type=str,
+                        help='Write listing of machine code and source to FILE')
+    parser.add_argument('--rom', metavar='FILE', type=str,
+                        help='Write code memory image to FILE (.hex, .bin, .coe or .mem)')
+    parser.add_argument('--ram', metavar='FILE', type=str,
+                        help='Write data memory image to FILE (.hex, .bin, .coe or .mem)')
     parser.add_argument('-S', action='store_true',
                         help='Output assembly code')
     parser.add_argument('-O', type=int,
                         help='Optimization level', default='2', choices=[0, 1, 2])
+    parser.add_argument('--server', metavar='SOCKET', type=str, nargs='?', const='-',
+                        help='Compile JSON requests from stdin or a Unix socket (see puc8.server)')
+    parser.add_argument('-j', '--jobs', metavar='N', type=int,
+                        help='Number of server worker processes (default: number of CPUs)')
 
     args = parser.parse_args()
 
-    with open(args.file, 'r') as f:
-        asm = io.StringIO(compile(f, args.O))
-
-    pp  = Preprocessor()
-    asm = pp.process(asm)
+    if args.server is not None:
+        from .server import serve
+        try:
+            serve(args.server, args.jobs)
+        except ValueError as e:
+            parser.error(str(e))
+        return
+    if args.file is None:
+        parser.error('the following arguments are required: file')
 
-    ass = Assembler()
-    mem = ass.process(asm)
+    # Importing the C frontend and ppci takes most of the startup time, so
+    # --help and argument errors don't wait for it
+    from .compiler import compile, compile_image
 
-    if args.simulate or args.test:
-        sim = Simulator()
-        if args.simulate:
-            sim.process(mem)
+    with open(args.file, 'r') as f:
+        if args.S:
+            asm = Preprocessor().process(io.StringIO(compile(f, args.O)))
+            mem = Assembler().process(asm)
         else:
-            pc = sim.run(mem, 1000)
-            if pc != args.test:
-                raise RuntimeError('PC after 1000 steps is ' + str(pc) + ', expected ' + str(args.test))
+            # Link directly, without going through assembly
+            mem = compile_image(f, args.O)
+
+    if args.map is not None:
+        with open(args.map, 'w') as f:
+            emitmap(mem, f)
+    if args.listing is not None:
+        with open(args.listing, 'w') as f:
+            emitlisting(mem, f)
+    if args.rom is not None:
+        emitimage(mem, 'code', args.rom)
+    if args.ram is not None:
+        emitimage(mem, 'data', args.ram)
+
+    if args.simulate or args.test is not None:
+        devices = None
+        if args.test is not None or args.input is not None:
+            # Never block on the keyboard when testing
+            devices = headless(codecs.decode(args.input or '', 'unicode_escape'), echo=True)
+        sim = JITSimulator(mem.symbols, devices) if args.jit else Simulator(mem.symbols, devices)
+        if args.profile:
+            sim.profile = Profile()
+        if args.trace is not None:
+            sim.trace = TraceWriter(args.trace)
+        try:
+            if args.simulate:
+                sim.process(mem)
+                if args.profile:
+                    sim.profile.report(sim)
+            else:
+                res = sim.simulate(mem, args.steps)
+                if args.profile:
+                    sim.profile.report(sim)
+                pc = res.state.regs[15]
+                if pc != args.test:
+                    raise RuntimeError('PC after ' + str(res.cycles) + ' steps is ' + str(pc) + ', expected ' + str(args.test))
+        finally:
+            if sim.trace is not None:
+                sim.trace.close()
     else:
         if args.output != '-':
             f = open(args.output, 'w')
@@ -53,7 +119,7 @@ def main():
 
         if args.S:
             # Don't emit machine code, just compiled assembly.
-            for (idx, label, inst) in asm:
+            for (idx, label, inst, _, _, _) in asm:
                 print((label + ': ' if label != '' else '') + inst, file=f)
         else:
             emitvhdl(mem, f)
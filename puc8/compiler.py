@@ -4,31 +4,43 @@
 
 from io import StringIO
 
+from .image import Image
 from .ppci.lang.c import c_to_ir
-from .ppci.api import ir_to_assembly, optimize
+from .ppci.api import ir_to_assembly, ir_to_stream, optimize
+from .ppci.binutils.outstream import OutputStream
+from .ppci.arch.generic_instructions import Label, SectionInstruction, Global, SetSymbolType, Alignment
+from .ppci.arch.data_instructions import DByte
+from .ppci.arch.puc8.instructions import PUC8Instruction, CallL, B
+
+# Memory-mapped I/O registers at the start of data memory
+registers = ['btn', 'enc', 'kdr', 'udr', 'usr', 'led', 'ssd', 'ldr', 'lcr']
+
+# Start of C data
+org = 0x10
+
+# Number of words in code and data memory
+depth = 256
+
+def _ir(src, opt_level):
+    """Compiles C source to optimized IR."""
+    ir_module = c_to_ir(src, 'puc8')
+    optimize(ir_module, level=opt_level)
+    return ir_module
 
 def compile(src, opt_level):
-    asm = """
-.section data
-btn: .db 0
-enc: .db 0
-kdr: .db 0
-udr: .db 0
-usr: .db 0
-led: .db 0
-ssd: .db 0
-ldr: .db 0
-lcr: .db 0
-.org 0x10
+    """Compiles C source to assembly."""
+    asm = '\n.section data\n'
+    for reg in registers:
+        asm += f'{reg}: .db 0\n'
+    asm += f"""\
+.org 0x{org:x}
 
 .section code
 call @main
 loop: b @loop
 """
-    ir_module = c_to_ir(src, 'puc8')
-    optimize(ir_module, level=opt_level)
 
-    ppci_asm = StringIO(ir_to_assembly([ir_module], 'puc8'))
+    ppci_asm = StringIO(ir_to_assembly([_ir(src, opt_level)], 'puc8'))
 
     lbl = ''
     for l in ppci_asm.readlines():
@@ -50,3 +62,111 @@ loop: b @loop
             lbl = ''
 
     return asm
+
+class ImageOutputStream(OutputStream):
+    """Output stream that collects ppci instructions and data for a memory
+    image. Label references are resolved by link()."""
+    def __init__(self):
+        self.section = None
+        self.label = ''
+        self.labels = {}
+        self.relocations = []
+        self.words = {'code': [], 'data': []}
+        self.items = {'code': [], 'data': []}
+
+    def org(self, addr):
+        """Pads the current section with unlabeled zeros until addr."""
+        while len(self.words[self.section]) < addr:
+            self.words[self.section].append(0)
+            self.items[self.section].append(None)
+
+    def do_emit(self, item):
+        if isinstance(item, SectionInstruction):
+            self.section = item.name
+        elif isinstance(item, Label):
+            # Same error as the assembler gives on the text path
+            if item.name in self.labels:
+                raise SyntaxError(f'Redefinition of label {item.name}')
+            # Code addresses are in bytes as far as ppci is concerned
+            self.labels[item.name] = (self.section, len(self.words[self.section]) * (4 if self.section == 'code' else 1))
+            self.label = item.name
+        elif isinstance(item, (Global, SetSymbolType, Alignment)):
+            pass
+        else:
+            if isinstance(item, PUC8Instruction):
+                if self.section != 'code':
+                    raise ValueError(f'Cannot use instructions in {self.section} section')
+                for reloc in item.gen_relocations():
+                    self.relocations.append((len(self.words['code']), reloc))
+                word = int.from_bytes(item.encode(), 'big')
+            elif isinstance(item, DByte):
+                if self.section != 'data':
+                    raise ValueError(f'Cannot use data in {self.section} section')
+                word = item.v & 255
+            else:
+                raise ValueError(f'Cannot link {item}')
+            self.words[self.section].append(word)
+            self.items[self.section].append((self.label, item))
+            self.label = ''
+
+def compile_image(src, opt_level):
+    """Compiles C source directly to a memory image.
+
+    The instructions generated by ppci are linked into the image without
+    printing and reassembling them. Every word is still annotated with its
+    label and instruction, but not with a source line."""
+    stream = ImageOutputStream()
+
+    stream.select_section('data')
+    for reg in registers:
+        stream.emit(Label(reg))
+        stream.emit(DByte(0))
+    stream.org(org)
+
+    stream.select_section('code')
+    stream.emit(CallL('main'))
+    stream.emit(Label('loop'))
+    stream.emit(B('loop'))
+
+    ir_to_stream(_ir(src, opt_level), 'puc8', stream)
+
+    return link(stream)
+
+def link(stream):
+    """Resolves label references and builds memory image from an ImageOutputStream."""
+    words = stream.words
+    for section in ('code', 'data'):
+        if len(words[section]) > depth:
+            raise ValueError(f'Program requires {len(words[section])} words of {section} memory, but only {depth} are available')
+
+    code = list(words['code'])
+    for addr, reloc in stream.relocations:
+        if reloc.symbol_name not in stream.labels:
+            raise ValueError(f"label '{reloc.symbol_name}' not defined")
+        code[addr] |= reloc.calc(stream.labels[reloc.symbol_name][1], addr * 4)
+
+    ls = max(len(label) for label in stream.labels)
+
+    mem = Image()
+    for section, values in (('code', code), ('data', words['data'])):
+        for value, item in zip(values, stream.items[section]):
+            if item is None:
+                mem.append(section, value)
+                continue
+            label, inst = item[0], str(item[1])
+            if inst.startswith('.byte'):
+                inst = '.db' + inst[5:]
+            if label != '':
+                ref = f'{label}: ' + ' ' * (ls-len(label))
+            else:
+                ref = ' ' * (ls + 2)
+            mem.append(section, value, f'{ref}{inst}')
+
+    # Symbol table, in order of definition
+    for label, (section, value) in stream.labels.items():
+        if section == 'code':
+            value //= 4
+        mem.labels[label] = (section, value)
+        mem.symbols[section].setdefault(value, label)
+
+    return mem
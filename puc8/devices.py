@@ -0,0 +1,114 @@
+"""Memory-mapped I/O devices for ENG1448 8-bit processor simulator
+   (c) 2020-2023 Wouter Caarls, PUC-Rio
+"""
+
+# Memory-mapped I/O addresses, prefixed so that they are not confused with
+# the simulator's operation identifiers (LDR)
+(ADDR_BTN, ADDR_ENC, ADDR_KDR, ADDR_UDR, ADDR_USR,
+ ADDR_LED, ADDR_SSD, ADDR_LDR, ADDR_LCR) = range(9)
+
+class Device:
+    """Memory-mapped I/O device. By default behaves as plain memory."""
+    def read(self, state, addr):
+        """Returns the value read from an address."""
+        return state.mem[addr]
+
+    def write(self, state, addr, value):
+        """Writes a value to an address."""
+        state.mem[addr] = value
+
+class Keyboard(Device):
+    """Keyboard that asks the user for a character on every read."""
+    def read(self, state, addr):
+        inp = input('Enter keyboard character: ')
+        if len(inp) > 0:
+            return ord(inp[0])&255
+        else:
+            return 0
+
+class ScriptedInput(Device):
+    """Input register returning successive values from a script.
+
+    Values may be integers or characters. Once the script is exhausted,
+    reads return 0."""
+    def __init__(self, values=()):
+        self.values = iter(values)
+
+    def read(self, state, addr):
+        val = next(self.values, 0)
+        if isinstance(val, str):
+            val = ord(val)
+        return val&255
+
+class Capture(Device):
+    """Output register that records every value written to it."""
+    def __init__(self, store=True):
+        self.values = []
+        self.store = store
+
+    def write(self, state, addr, value):
+        self.values.append(value)
+        if self.store:
+            state.mem[addr] = value
+
+class LCD(Device):
+    """Character LCD mapped at the data and command registers.
+
+    Characters written to the data register are appended to text and, if
+    echo is set, printed. The clear command (1) starts a new line. The
+    display is never busy."""
+    def __init__(self, echo=True):
+        self.echo = echo
+        self.text = ''
+
+    def write(self, state, addr, value):
+        if addr == ADDR_LDR:
+            self.text += chr(value)
+            if self.echo:
+                print(chr(value), end='')
+        elif addr == ADDR_LCR and value == 1:
+            self.text += '\n'
+            if self.echo:
+                print()
+        else:
+            state.mem[addr] = value
+
+class Watchpoint(Device):
+    """Wraps a device (or plain memory, if device is None) and records
+    reads and/or writes in a list of hits before passing them on."""
+    def __init__(self, device, hits, read=False, write=True):
+        self.device = device
+        self.hits = hits
+        self.reads = read
+        self.writes = write
+
+    def read(self, state, addr):
+        if self.device is None:
+            value = super().read(state, addr)
+        else:
+            value = self.device.read(state, addr)
+        if self.reads:
+            self.hits.append(f'read [{addr}] = {value}')
+        return value
+
+    def write(self, state, addr, value):
+        if self.writes:
+            self.hits.append(f'write [{addr}] = {value}')
+        if self.device is None:
+            super().write(state, addr, value)
+        else:
+            self.device.write(state, addr, value)
+
+def console():
+    """Returns devices that interact with the user on the console."""
+    lcd = LCD()
+    return {ADDR_KDR: Keyboard(), ADDR_LDR: lcd, ADDR_LCR: lcd}
+
+def headless(keys=(), echo=False):
+    """Returns devices that never block, with scripted keyboard input and
+    captured LCD, LED and seven-segment display output.
+
+    The buttons, encoder and UART are not modelled. Their registers behave
+    as plain memory, so programs read whatever was stored there."""
+    lcd = LCD(echo)
+    return {ADDR_KDR: ScriptedInput(keys), ADDR_LDR: lcd, ADDR_LCR: lcd, ADDR_LED: Capture(), ADDR_SSD: Capture()}
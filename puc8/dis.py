@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+"""Disassembler for ENG1448 8-bit processor ROM images
+   (c) 2020-2023 Wouter Caarls, PUC-Rio
+"""
+
+import os, re, sys, argparse
+
+from .disassembler import Disassembler
+from .simulator import decode, ILL, LDR, MOV, B, BGE, CALL, POP, ADD, EOR
+from .ppci.format.hexfile import hexfields, DATA
+
+# Number of ROM words
+depth = 256
+
+def readvhdl(f):
+    """Reads the ROM array of VHDL code or package written by emitvhdl."""
+    code = [0] * depth
+    for line in f:
+        m = re.match(r'\s*(\d+)\s*=>\s*"([01]{17})"', line)
+        if m:
+            code[int(m[1])] = int(m[2], 2)
+    return code
+
+def readhex(f):
+    """Reads an Intel HEX ROM image with 17-bit words at word addresses."""
+    code = [0] * depth
+    for line in hexfields(f):
+        if line.typ == DATA:
+            for i in range(0, len(line.data), 3):
+                code[line.address + i//3] = int.from_bytes(line.data[i:i+3], 'big')
+    return code
+
+def readbin(f):
+    """Reads a raw ROM image of big-endian 17-bit words."""
+    data = f.read()
+    return [int.from_bytes(data[i:i+3], 'big') for i in range(0, len(data), 3)]
+
+def readcoe(f):
+    """Reads a Xilinx coefficient file in radix 2."""
+    text = f.read()
+    vector = text[text.index('=', text.index('memory_initialization_vector'))+1:]
+    return [int(word, 2) for word in re.findall(r'[01]+', vector)]
+
+def readmem(f):
+    """Reads a Xilinx memory file."""
+    code = [0] * depth
+    addr = 0
+    for word in f.read().split():
+        if word[0] == '@':
+            addr = int(word[1:], 16)
+        else:
+            code[addr] = int(word, 16)
+            addr += 1
+    return code
+
+# ROM image readers by file extension, and whether they read binary files
+formats = {'.vhdl': (readvhdl, False),
+           '.vhd': (readvhdl, False),
+           '.hex': (readhex, False),
+           '.bin': (readbin, True),
+           '.coe': (readcoe, False),
+           '.mem': (readmem, False)}
+
+def readimage(file):
+    """Reads ROM image from file, in the format given by its extension."""
+    ext = os.path.splitext(file)[1].lower()
+    if ext not in formats:
+        raise ValueError(f'Unknown ROM image format {ext!r}, expected one of {", ".join(formats)}')
+    read, binary = formats[ext]
+    with open(file, 'rb' if binary else 'r') as f:
+        return read(f)
+
+def readmap(file):
+    """Reads symbol table written by emitmap into a Disassembler memory map."""
+    map = {'code': {}, 'data': {}}
+    with open(file, 'r') as f:
+        for line in f:
+            section, value, label = line.split()
+            if section in map:
+                map[section].setdefault(int(value), label)
+    return map
+
+def flow(code):
+    """Finds basic blocks and calls in a ROM image.
+
+    Returns the set of block start addresses and a dictionary mapping
+    call targets to the addresses they are called from. Blocks end after
+    branches, calls, returns, illegal instructions and instructions that
+    write the PC. Branches and calls through registers have no known target."""
+    leaders = {0}
+    calls = {}
+    for addr, word in enumerate(code):
+        inst = decode(word)
+        m = inst.op
+        if B <= m <= BGE or m == CALL:
+            if inst.imm:
+                leaders.add(inst.c8)
+                if m == CALL:
+                    calls.setdefault(inst.c8, []).append(addr)
+        elif not (m == ILL or (inst.rd == 15 and (m in (LDR, MOV, POP) or ADD <= m <= EOR))):
+            continue
+        leaders.add(addr + 1)
+    return leaders, calls
+
+def emitdis(code, disassembler, f):
+    """Emit disassembly of a ROM image, separated into basic blocks."""
+    # Padding at the end of the ROM is not interesting
+    size = len(code)
+    while size > 0 and code[size-1] == 0:
+        size -= 1
+    code = code[:size]
+
+    leaders, calls = flow(code)
+    labels = disassembler.map['code'] if disassembler.map is not None else {}
+
+    for addr, (word, dis) in enumerate(zip(code, disassembler.disassemble_all(code))):
+        if addr in leaders:
+            comment = ''
+            if addr in calls:
+                comment = '; called from ' + ', '.join(str(a) for a in calls[addr])
+            print(file=f)
+            if addr in labels:
+                print(f'{labels[addr]+":":20} {comment}'.rstrip(), file=f)
+            elif comment != '':
+                print(comment, file=f)
+        bin = f'{word:017b}'
+        bin = f'{bin[0:4]} {bin[4]} {bin[5:9]} {bin[9:13]} {bin[13:17]}'
+        print(f'{addr:3}: {bin:21} {dis[1] if dis is not None else "; illegal instruction"}', file=f)
+
+    print(f'\n; {size} words, {len([a for a in leaders if a < size])} blocks, {len(calls)} call targets', file=f)
+
+def main():
+    parser = argparse.ArgumentParser(description='PUC8 Disassembler (c) 2020-2023 Wouter Caarls, PUC-Rio')
+    parser.add_argument('file', type=str, nargs='+',
+                        help='ROM image files (' + ', '.join(formats) + ')')
+    parser.add_argument('-o', '--output', type=str,
+                        help='Output file', default='-')
+    parser.add_argument('-m', '--map', metavar='FILE', type=str,
+                        help='Read symbol table from FILE')
+
+    args = parser.parse_args()
+
+    disassembler = Disassembler(readmap(args.map) if args.map is not None else None)
+
+    if args.output != '-':
+        f = open(args.output, 'w')
+    else:
+        f = sys.stdout
+
+    for file in args.file:
+        if len(args.file) > 1:
+            print(f'; {file}', file=f)
+        emitdis(readimage(file), disassembler, f)
+
+    if args.output != '-':
+        f.close()
+
+if __name__ == '__main__':
+    main()
@@ -7,47 +7,100 @@ from .instructions import defs
 regs = [f'r{reg}' for reg in range(13)]
 regs[13:16] = ['fp',  'sp', 'pc']
 
+# Instruction patterns as (mnemonic, opcode, opcode shift, minor, minor mask, operands)
+patterns = [(mnemonic, int(opcode, 2), 17-len(opcode), int(minor or '0', 2), (1 << len(minor)) - 1, operands)
+            for mnemonic in defs for (opcode, minor, operands) in defs[mnemonic] if opcode != '']
+
+def _extractors(mnemonic, shift, operands):
+    """Returns (kind, shift, mask) operand extractors for a pattern.
+
+    Kinds are those of the instruction definitions, except that signed
+    ldr/str offsets become 'O' and call and branch targets become 'T'."""
+    extractors = []
+    for i, o in enumerate(operands):
+        istart = shift-4*i
+        if o in 'RA':
+            extractors.append((o, istart-4, 15))
+        elif o == '4':
+            extractors.append(('O' if mnemonic in ('ldr', 'str') else '4', istart-4, 15))
+        elif o == 'B':
+            extractors.append((o, istart-8, 255))
+        elif o == '8':
+            extractors.append(('T' if mnemonic == 'call' or mnemonic[0] == 'b' else '8', istart-8, 255))
+    return tuple(extractors)
+
+# Decode table indexed by the upper 9 bits of an instruction word (major
+# opcode and branch condition or register field), listing the candidate
+# patterns as (minor, minor mask, mnemonic, extractors) in definition order.
+# Candidates that can never match, such as the pseudo-mnemonics beq and bne,
+# are left out.
+table = [[] for _ in range(512)]
+for (mnemonic, opcode, shift, minor, mask, operands) in patterns:
+    entry = (minor, mask, mnemonic, _extractors(mnemonic, shift, operands))
+    for index in range(opcode << (shift-8), (opcode+1) << (shift-8)):
+        if not any(m == minor and k == mask or k == 0 for (m, k, _, _) in table[index]):
+            table[index].append(entry)
+
+def lookup(inst):
+    """Returns (mnemonic, extractors) for an instruction word, or None if it is illegal."""
+    for (minor, mask, mnemonic, extractors) in table[inst >> 8]:
+        if inst & mask == minor:
+            return mnemonic, extractors
+    return None
+
 class Disassembler():
     """Disassemble machine code back to assembly."""
     def __init__(self, map=None):
         self.map = map
 
     def process(self, inst):
-        """Disassemble a single instruction, replacing addresses with labels if a memory map is available."""
-        for mnemonic in defs:
-            for (opcode, minor, operands) in defs[mnemonic]:
-                if opcode != '' and inst[:len(opcode)] == opcode and (minor == '' or inst[-len(minor):] == minor):
-                    dis = f'{mnemonic:4} '
-                    for i, o in enumerate(operands):
-                        istart = len(opcode)+4*i
-                        reg = int(inst[istart:istart+4], 2)
-
-                        if o == 'R':
-                            dis += f'{regs[reg]}, '
-                        elif o == 'A':
-                            dis += f'[{regs[reg]}], '
-                        elif o == 'B':
-                            addr = int(inst[istart:istart+8], 2)
-                            if self.map is not None and addr in self.map['data']:
-                                dis += f"[@{self.map['data'][addr]}], "
-                            else:
-                                dis += f'[{addr}], '
-                        elif o == '4':
-                            val = int(inst[istart:istart+4], 2)
-                            if mnemonic == 'ldr' or mnemonic == 'str':
-                                if val > 7:
-                                    # signed
-                                    val -= 16
-                                # Convert [addr], offset into [addr, offset]
-                                dis = dis[:-3] + f', {val}], '
-                            else:
-                                dis += f'{val}, '
-                        elif o == '8':
-                            val = int(inst[istart:istart+8], 2)
-                            if self.map is not None and 4*val in self.map['code'] and (mnemonic == 'call' or mnemonic[0] == 'b'):
-                                dis += f"@{self.map['code'][4*val]}, "
-                            else:
-                                dis += f'{val}, '
-                    dis = dis[:-2]
-                    return mnemonic, dis
-        raise ValueError(f'Illegal instruction {inst}')
+        """Disassemble a single instruction word, replacing addresses with labels if a memory map is available."""
+        if isinstance(inst, str):
+            inst = int(inst, 2)
+
+        pattern = lookup(inst)
+        if pattern is None:
+            raise ValueError(f'Illegal instruction {inst:017b}')
+        mnemonic, extractors = pattern
+
+        ops = []
+        for (kind, shift, mask) in extractors:
+            val = inst >> shift & mask
+            if kind == 'R':
+                ops.append(regs[val])
+            elif kind == 'A':
+                ops.append(f'[{regs[val]}]')
+            elif kind == 'O':
+                # Convert [addr], offset into [addr, offset]
+                ops[-1] = f'{ops[-1][:-1]}, {val - 16 if val > 7 else val}]'
+            elif kind == 'B':
+                if self.map is not None and val in self.map['data']:
+                    ops.append(f"[@{self.map['data'][val]}]")
+                else:
+                    ops.append(f'[{val}]')
+            elif kind == 'T' and self.map is not None and val in self.map['code']:
+                ops.append(f"@{self.map['code'][val]}")
+            else:
+                ops.append(f'{val}')
+
+        if ops:
+            return mnemonic, f'{mnemonic:4} ' + ', '.join(ops)
+        return mnemonic, mnemonic
+
+    def disassemble_all(self, code):
+        """Disassemble a sequence of instruction words (or the code section
+        of an Image), returning a (mnemonic, disassembly) tuple for every
+        word, or None for illegal instructions."""
+        code = getattr(code, 'code', code)
+
+        # ROM images repeat many words, such as the zeros padding them
+        done = {}
+        result = []
+        for inst in code:
+            if inst not in done:
+                try:
+                    done[inst] = self.process(inst)
+                except ValueError:
+                    done[inst] = None
+            result.append(done[inst])
+        return result
@@ -4,39 +4,64 @@
 
 import os
 
-def emitasmsection(section, f):
+from .image import widths
+from .ppci.format.hexfile import HexLine, DATA, EOF
+
+# Number of memory words
+depth = 256
+
+def emitasmsection(refs, f):
     """Emit assembly for a section."""
     addr = 0
     skipped = False
-    for c in section:
-        if c[1] == '':
+    for ref in refs:
+        if ref == '':
             skipped = True
         else:
             if skipped == True:
                 print(f'.org {addr}', file=f)
                 skipped = False
-            print(c[1], file=f)
+            print(ref, file=f)
         addr += 1
 
 
 def emitasm(mem, f):
     """Emit assembly for code and data sections."""
     print('.section code', file=f)
-    emitasmsection(mem['code'], f)
+    emitasmsection(mem.refs['code'], f)
     print('.section data', file=f)
-    emitasmsection(mem['data'], f)
+    emitasmsection(mem.refs['data'], f)
+
+def emitmap(mem, f):
+    """Emit symbol table, sorted by section and value. Labels with the same
+    value keep their definition order, so the first one names the address."""
+    for label, (section, value) in sorted(mem.labels.items(), key=lambda l: (l[1][0] or '.equ', l[1][1])):
+        print(f'{section or ".equ":7} {value:3} {label}', file=f)
 
-def emitarray(section, f):
+def emitlisting(mem, f):
+    """Emit listing of addresses, machine code and source."""
+    for section in ('code', 'data'):
+        print(f'.section {section}', file=f)
+        width = widths[section]
+        for addr, (val, ref) in enumerate(zip(getattr(mem, section), mem.refs[section])):
+            if ref != '':
+                bin = f'{val:0{width}b}'
+                if section == 'code':
+                    bin = f'{bin[0:4]} {bin[4]} {bin[5:9]} {bin[9:13]} {bin[13:17]}'
+                print(f'{addr:3}: {bin:21} {ref}', file=f)
+
+def emitarray(mem, section, f):
     """Emit a VHDL array for a section."""
+    width = widths[section]
     print('(', file=f)
-    for l, c in enumerate(section):
-        if (c[0] != '00000000000000000' and c[0] != '00000000') or c[1] != '':
-            print(f"    {l:3} => \"{c[0]}\", -- {c[1]}", file=f)
+    for l, (val, ref) in enumerate(zip(getattr(mem, section), mem.refs[section])):
+        if val != 0 or ref != '':
+            print(f"    {l:3} => \"{val:0{width}b}\", -- {ref}", file=f)
     print("     others => (others => '0'));", file=f)
 
 def emitvhdl(mem, f):
     """Emit VHDL for code and data sections."""
-    if f.name != '<stdout>':
+    if getattr(f, 'name', '<stdout>') != '<stdout>':
         pkg = os.path.splitext(os.path.basename(f.name))[0]
         print(
     f"""library ieee;
@@ -50,13 +75,59 @@ package {pkg} is
     else:
         pkg = ''
         print(f"""  signal rom: ROMT := """, file=f, end='')
-    emitarray(mem['code'], f)
+    emitarray(mem, 'code', f)
 
     if pkg != '':
         print(f'  constant {pkg}_ram: {pkg}RAMT := ', file=f, end='')
     else:
         print(f'  signal ram: RAMT := ', file=f, end='')
-    emitarray(mem['data'], f)
+    emitarray(mem, 'data', f)
 
     if pkg != '':
         print(f'end package {pkg};', file=f)
+
+def _bytes(mem, section):
+    """Returns the words of a section as big-endian bytes."""
+    size = (widths[section] + 7) // 8
+    return [val.to_bytes(size, 'big') for val in getattr(mem, section)]
+
+def emithex(mem, section, f):
+    """Emit Intel HEX for a section, one word per record at its word address."""
+    for addr, word in enumerate(_bytes(mem, section)):
+        print(HexLine(addr, DATA, word).to_line().upper(), file=f)
+    print(HexLine(0, EOF).to_line().upper(), file=f)
+
+def emitbin(mem, section, f):
+    """Emit raw big-endian binary for a section."""
+    f.write(b''.join(_bytes(mem, section)))
+
+def emitcoe(mem, section, f):
+    """Emit Xilinx coefficient file for a section, padded to full depth."""
+    width = widths[section]
+    values = list(getattr(mem, section))
+    values += [0] * (depth - len(values))
+    print('memory_initialization_radix=2;', file=f)
+    print('memory_initialization_vector=', file=f)
+    print(',\n'.join(f'{val:0{width}b}' for val in values) + ';', file=f)
+
+def emitmem(mem, section, f):
+    """Emit Xilinx memory file (as used by updatemem) for a section."""
+    digits = (widths[section] + 3) // 4
+    print('@0000', file=f)
+    for val in getattr(mem, section):
+        print(f'{val:0{digits}X}', file=f)
+
+# Memory image emitters by file extension, and whether they write binary files
+formats = {'.hex': (emithex, False),
+           '.bin': (emitbin, True),
+           '.coe': (emitcoe, False),
+           '.mem': (emitmem, False)}
+
+def emitimage(mem, section, file):
+    """Write memory image of a section to file, in the format given by its extension."""
+    ext = os.path.splitext(file)[1].lower()
+    if ext not in formats:
+        raise ValueError(f'Unknown memory image format {ext!r}, expected one of {", ".join(formats)}')
+    emit, binary = formats[ext]
+    with open(file, 'wb' if binary else 'w') as f:
+        emit(mem, section, f)
@@ -0,0 +1,40 @@
+"""Assembled memory image for ENG1448 8-bit processor
+   (c) 2020-2023 Wouter Caarls, PUC-Rio
+"""
+
+from array import array
+
+# Word width of each section in bits
+widths = {'code': 17, 'data': 8}
+
+class Image:
+    """Assembled code and data memory.
+
+    Code words are stored in an array of integers and data bytes in a
+    bytearray. The source reference (listing comment) and source location
+    of every address are kept in side tables, and are empty for addresses
+    that were only filled to reach an .org directive.
+
+    labels maps every label to its section and address (or None and its
+    value for .equ constants), and symbols maps the addresses in each
+    section to the first label defined there, as used by the Disassembler.
+
+    For compatibility, indexing with a section name returns a list of
+    (binary string, reference) tuples."""
+    def __init__(self):
+        self.code = array('I')
+        self.data = bytearray()
+        self.refs = {'code': [], 'data': []}
+        self.source = {'code': [], 'data': []}
+        self.labels = {}
+        self.symbols = {'code': {}, 'data': {}}
+
+    def append(self, section, value, ref='', source=''):
+        """Appends a word to a section."""
+        getattr(self, section).append(value)
+        self.refs[section].append(ref)
+        self.source[section].append(source)
+
+    def __getitem__(self, section):
+        width = widths[section]
+        return [(f'{value:0{width}b}', ref) for value, ref in zip(getattr(self, section), self.refs[section])]
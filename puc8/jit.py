@@ -0,0 +1,261 @@
+"""Basic-block translating simulator for ENG1448 8-bit processor
+   (c) 2020-2023 Wouter Caarls, PUC-Rio
+"""
+
+from collections import namedtuple
+
+from .simulator import (Simulator, Result, ILL, LDR, STR, MOV, B, BZ, BNZ, BCS, BCC, BLT, BGE,
+                        PUSH, CALL, POP, ADD, SUB, SHL, SHR, AND, ORR, EOR)
+
+Block = namedtuple('Block', ['fn', 'length', 'last', 'branch', 'src'])
+
+# Maximum number of instructions in a translated block
+MAX_BLOCK = 64
+
+class JITSimulator(Simulator):
+    """Simulates machine code by translating basic blocks into Python functions.
+
+    A block runs from its start address up to and including the first
+    instruction that may change the PC. Registers are kept in local variables
+    within a block, and flags are only computed for the last instruction
+    that sets them."""
+    def __init__(self, map = None, devices = None):
+        self.blocks = {}
+        self.stops = set()
+        super().__init__(map, devices)
+
+    def load(self, mem):
+        """Decodes code section, drops translated blocks and returns initial machine state."""
+        self.blocks = {}
+        return super().load(mem)
+
+    def attach(self, addr, device):
+        """Maps an I/O device at a data memory address, dropping translated blocks."""
+        super().attach(addr, device)
+        self.blocks = {}
+
+    def patch(self, addr, word):
+        """Replaces the instruction at a ROM address, invalidating blocks that contain it."""
+        super().patch(addr, word)
+        for start, block in list(self.blocks.items()):
+            if start <= addr <= block.last:
+                del self.blocks[start]
+
+    def translate(self, start):
+        """Returns the translated block starting at a ROM address."""
+        block = self.blocks.get(start)
+        if block is None:
+            block = self._translate(start)
+            self.blocks[start] = block
+        return block
+
+    def _translate(self, start):
+        """Generates and compiles Python source for a block."""
+        body = []
+        read = set()
+        written = []
+        flags = None
+
+        def reg(r, pc):
+            """Returns expression for reading a register."""
+            if r == 15:
+                return str(pc)
+            if r not in written:
+                read.add(r)
+            return f'r{r}'
+
+        def write(r, expr):
+            body.append(f'    r{r} = {expr}')
+            if r not in written:
+                written.append(r)
+
+        def exit(pc, indent='    '):
+            """Returns lines that store registers, flags and PC."""
+            lines = [f'{indent}regs[{r}] = r{r}' for r in written]
+            if flags is not None:
+                lines += [f'{indent}state.{f} = {e}' for f, e in zip(('zero', 'carry', 'negative', 'overflow'), flags)]
+            lines.append(f'{indent}regs[15] = {pc}')
+            return lines
+
+        def fault(cond, pc, msg):
+            body.append(f'    if {cond}:')
+            body.extend(exit((pc + 1)&255, '        '))
+            body.append(f'        raise {msg}')
+
+        def flag(name):
+            if flags is not None:
+                return flags[('zero', 'carry', 'negative', 'overflow').index(name)]
+            return f'state.{name}'
+
+        pc = start
+        npc = None
+        branch = False
+        while True:
+            m, r1, r2, r3, c4i, c4, c8, imm = self.rom[pc]
+            k = len(body)
+            nextpc = (pc + 1)&255
+
+            if imm:
+                addr = str(c8)
+            elif c4i:
+                addr = f'({reg(r2, pc)} + {c4i})&255'
+            else:
+                addr = reg(r2, pc)
+
+            if m == LDR:
+                if imm and self.io[c8] is None:
+                    val = f'mem[{c8}]'
+                elif imm:
+                    val = f'io[{c8}].read(state, {c8})'
+                else:
+                    body.append(f'    a{k} = {addr}')
+                    val = f'mem[a{k}] if io[a{k}] is None else io[a{k}].read(state, a{k})'
+                if r1 == 15:
+                    body.append(f'    n{k} = {val}')
+                    npc = f'n{k}'
+                else:
+                    write(r1, val)
+            elif m == STR:
+                d = reg(r1, pc)
+                if imm and self.io[c8] is None:
+                    body.append(f'    mem[{c8}] = {d}')
+                elif imm:
+                    body.append(f'    io[{c8}].write(state, {c8}, {d})')
+                else:
+                    body.append(f'    a{k} = {addr}')
+                    body.append(f'    if io[a{k}] is None:')
+                    body.append(f'        mem[a{k}] = {d}')
+                    body.append(f'    else:')
+                    body.append(f'        io[a{k}].write(state, a{k}, {d})')
+            elif m == MOV:
+                val = str(c8) if imm else reg(r2, pc)
+                body.append(f'    t{k} = {val}')
+                flags = (f't{k} == 0', 'False', f'(t{k} & 128) != 0', 'False')
+                if r1 == 15:
+                    npc = f't{k}'
+                else:
+                    write(r1, f't{k}')
+            elif B <= m <= BGE:
+                if imm:
+                    target = str(c8)
+                elif r2 == 15:
+                    target = str((nextpc + c4i)&255)
+                else:
+                    target = f'({reg(r2, pc)} + {c4i})&255'
+                cond = {B: None,
+                        BZ: flag('zero'), BNZ: f'not ({flag("zero")})',
+                        BCS: flag('carry'), BCC: f'not ({flag("carry")})',
+                        BLT: f'({flag("overflow")}) != ({flag("negative")})',
+                        BGE: f'({flag("overflow")}) == ({flag("negative")})'}[m]
+                if cond is None:
+                    npc = target
+                else:
+                    npc = f'{target} if {cond} else {nextpc}'
+                branch = True
+            elif m == PUSH:
+                sp = reg(14, pc)
+                fault(f'{sp} == 0', pc, 'RuntimeError(\'Stack overflow\')')
+                body.append(f'    mem[{sp}] = {reg(r1, pc)}')
+                write(14, f'{sp} - 1')
+            elif m == POP:
+                sp = reg(14, pc)
+                fault(f'{sp} == 255', pc, 'RuntimeError(\'Stack underflow\')')
+                if r1 == 15:
+                    body.append(f'    n{k} = mem[{sp} + 1]')
+                    npc = f'n{k}'
+                    write(14, f'({sp} + 1)&255')
+                else:
+                    write(r1, f'mem[{sp} + 1]')
+                    write(14, f'(r14 + 1)&255')
+            elif m == CALL:
+                sp = reg(14, pc)
+                fault(f'{sp} == 0', pc, 'RuntimeError(\'Stack overflow\')')
+                body.append(f'    mem[{sp}] = {nextpc}')
+                npc = str(c8) if imm else reg(r2, pc)
+                if not imm:
+                    body.append(f'    c{k} = {npc}')
+                    npc = f'c{k}'
+                write(14, f'{sp} - 1')
+            elif m == ILL:
+                fault('True', pc, f'ValueError(\'Illegal instruction at address {pc}\')')
+                npc = str(nextpc)
+            else:
+                # ALU instructions (modify flags)
+                a = reg(r2, pc)
+                if imm:
+                    val = str(c4) if m < AND else str(1<<c4)
+                else:
+                    val = reg(r3, pc)
+                if m == ADD or m == SUB:
+                    body.append(f'    a{k} = {a}')
+                    body.append(f'    v{k} = {val}')
+                    if m == ADD:
+                        body.append(f'    t{k} = a{k} + v{k}')
+                        ovf = f'((~(a{k} ^ v{k}) & (a{k} ^ t{k})) & 128) != 0'
+                    else:
+                        body.append(f'    t{k} = a{k} + (256 - v{k})')
+                        ovf = f'(((a{k} ^ v{k}) & (a{k} ^ t{k})) & 128) != 0'
+                else:
+                    op = {SHL: f'{a} << 1', SHR: f'{a} >> 1',
+                          AND: f'{a} & {val}', ORR: f'{a} | {val}', EOR: f'{a} ^ {val}'}[m]
+                    body.append(f'    t{k} = {op}')
+                    ovf = 'False'
+                flags = (f'(t{k} & 255) == 0', f'(t{k} & 256) != 0', f'(t{k} & 128) != 0', ovf)
+                if r1 == 15:
+                    npc = f't{k} & 255'
+                else:
+                    write(r1, f't{k} & 255')
+
+            length = pc - start + 1
+            if npc is not None or length == MAX_BLOCK or nextpc == 0 or nextpc in self.stops:
+                break
+            pc = nextpc
+
+        if npc is None:
+            npc = str(nextpc)
+
+        src = [f'def block(state, regs, mem):']
+        src += [f'    r{r} = regs[{r}]' for r in sorted(read)]
+        src += body
+        src += exit(npc)
+        src = '\n'.join(src) + '\n'
+
+        namespace = {'io': self.io}
+        exec(compile(src, f'<block {start}>', 'exec'), namespace)
+        return Block(namespace['block'], length, pc, branch, src)
+
+    def simulate(self, mem, steps=1000, halt=True, pcs=(), until=None):
+        """Simulate machine code until a stop condition is met.
+
+        Equivalent to Simulator.simulate, but executes whole blocks at a time.
+        A predicate is evaluated after every instruction, so specifying one
+        (or profiling or tracing) falls back to instruction-level simulation."""
+        if until is not None or self.profile is not None or self.trace is not None:
+            return super().simulate(mem, steps, halt, pcs, until)
+
+        state = self.load(mem)
+        regs = state.regs
+        mem = state.mem
+        self.stops = set(pcs)
+
+        cycle = 0
+        while cycle < steps:
+            pc = regs[15]
+            block = self.translate(pc)
+            if cycle + block.length > steps:
+                # Not enough budget for the whole block
+                self.step(state)
+                cycle += 1
+                last = pc
+                branch = B <= self.rom[pc].op <= BGE
+            else:
+                block.fn(state, regs, mem)
+                cycle += block.length
+                last = block.last
+                branch = block.branch
+            if regs[15] == last and halt and branch:
+                return Result(state, cycle, 'halt')
+            if regs[15] in self.stops:
+                return Result(state, cycle, 'pc')
+
+        return Result(state, steps, 'steps')
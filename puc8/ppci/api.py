@@ -10,7 +10,7 @@ import stat
 import xml
 from .lang.c import preprocess, c_to_ir, COptions
 from .irutils import verify_module
-from .utils.reporting import DummyReportGenerator, HtmlReportGenerator
+from .utils.reporting import DummyReportGenerator
 from .opt.transform import DeleteUnusedInstructionsPass
 from .opt.transform import RemoveAddZeroPass
 from .opt import CommonSubexpressionEliminationPass
@@ -21,18 +21,10 @@ from .opt.mem2reg import Mem2RegPromotor
 from .opt.cjmp import CJumpPass
 from .opt.tailcall import TailCallOptimization
 from .codegen import CodeGenerator
-from .binutils.linker import link
-from .binutils.archive import archive
 from .binutils.outstream import BinaryOutputStream, TextOutputStream
 from .binutils.outstream import MasterOutputStream, FunctionOutputStream
 from .binutils.objectfile import ObjectFile, get_object
 from .binutils.debuginfo import DebugInfo
-from .binutils.disasm import Disassembler
-from .format.hexfile import HexFile
-from .format.elf import write_elf
-from .format.exefile import ExeWriter
-from .format import uboot_image
-from .format.ldb import write_ldb
 #from .build.tasks import TaskError, TaskRunner
 #from .build.recipe import RecipeLoader
 from .common import CompilerError, DiagnosticsManager, get_file
@@ -55,12 +47,33 @@ __all__ = [
     "ir_to_assembly",
 ]
 
+# Linking and the object file formats are not needed to compile, so these
+# are only imported when first used.
+_lazy = {
+    "link": ".binutils.linker",
+    "archive": ".binutils.archive",
+}
+
+
+def __getattr__(name):
+    if name in _lazy:
+        import importlib
+
+        module = importlib.import_module(_lazy[name], __package__)
+        value = globals()[name] = getattr(module, name)
+        return value
+    raise AttributeError(
+        "module {!r} has no attribute {!r}".format(__name__, name)
+    )
+
 
 def get_reporter(reporter):
     if reporter is None:
         return DummyReportGenerator()
     elif isinstance(reporter, str):
         if reporter.endswith(".html"):
+            from .utils.reporting import HtmlReportGenerator
+
             f = open(reporter, "wt", encoding="utf8")
             r = HtmlReportGenerator(f)
             r.header()
@@ -159,6 +172,8 @@ def disasm(data, march):
         >>> source_file = io.BytesIO([0x77])
         >>> disasm(source_file, 'arm')
     """
+    from .binutils.disasm import Disassembler
+
     march = get_arch(march)
     disassembler = Disassembler(march)
     f = get_file(data)
@@ -366,6 +381,8 @@ def objcopy(obj: ObjectFile, image_name: str, fmt: str, output_filename):
         with open(output_filename, "wb") as output_file:
             output_file.write(image.data)
     elif fmt == "elf":
+        from .format.elf import write_elf
+
         elf_type = "executable" if obj.is_executable else "relocatable"
         with open(output_filename, "wb") as output_file:
             write_elf(obj, output_file, type=elf_type)
@@ -374,16 +391,22 @@ def objcopy(obj: ObjectFile, image_name: str, fmt: str, output_filename):
             chmod_x(output_filename)
 
     elif fmt == "hex":
+        from .format.hexfile import HexFile
+
         image = obj.get_image(image_name)
         hexfile = HexFile()
         hexfile.add_region(image.address, image.data)
         with open(output_filename, "wt", encoding="utf8") as output_file:
             hexfile.save(output_file)
     elif fmt == "ldb":
+        from .format.ldb import write_ldb
+
         # TODO: fix this some other way to extract debug info
         with open(output_filename, "wt", encoding="utf8") as output_file:
             write_ldb(obj, output_file)
     elif fmt == "uimage":
+        from .format import uboot_image
+
         image = obj.get_image(image_name)
         uboot_architectures = {
             "arm": uboot_image.Architecture.ARM,
@@ -399,6 +422,8 @@ def objcopy(obj: ObjectFile, image_name: str, fmt: str, output_filename):
                 arch=uboot_architectures[obj.arch.name],
             )
     elif fmt == "exe":
+        from .format.exefile import ExeWriter
+
         writer = ExeWriter()
         with open(output_filename, "wb") as output_file:
             writer.write(obj, output_file)
@@ -24,7 +24,6 @@
 """
 
 import sys
-import platform
 
 from .arch import Architecture, Frame
 from .isa import Isa
@@ -32,6 +31,8 @@ from .isa import Isa
 
 def get_current_arch():
     """ Try to get the architecture for the current platform """
+    import platform
+
     if sys.platform.startswith("win"):
         machine = platform.machine()
         if machine == "AMD64":
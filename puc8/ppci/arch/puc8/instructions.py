@@ -24,9 +24,32 @@ class PUC8Token(Token):
     c4 = bit_range(0, 4)
     c8 = bit_range(0, 8)
 
+# Bit range of every PUC8Token field
+fields = {name: (field._start, field._start + field._bitsize)
+          for name, field in vars(PUC8Token).items()
+          if getattr(field, "_start", None) is not None}
+
 class PUC8Instruction(Instruction):
     isa = isa
 
+    def encode(self):
+        """ Encode instruction directly into a PUC8Token word, without
+            filling in the token fields one by one """
+        word = 0
+        for field, value in self.patterns.items():
+            if not isinstance(value, int):
+                value = value.get_value(self)
+            b, e = fields[field]
+            limit = 1 << (e - b)
+            if value >= limit or value < -limit:
+                raise ValueError(
+                    "value {} cannot be fit into {} bits".format(value, e - b)
+                )
+            if value < 0:
+                value += limit
+            word |= value << b
+        return word.to_bytes(4, "big")
+
 def make_rrr(mnemonic, opcode, immediate):
     r1 = Operand("r1", PUC8Register, write=True)
     r2 = Operand("r2", PUC8Register, read=True)
@@ -31,10 +31,11 @@ def u8(x):
 
 
 class _p2(property):
-    def __init__(self, getter, setter, bitsize, signed):
+    def __init__(self, getter, setter, bitsize, signed, start=None):
         if bitsize < 1:
             raise TypeError("Cannot create field with less than 1 bit")
         self._bitsize = bitsize
+        self._start = start  # First bit, if the field is a single range
         self._signed = signed
         self._mask = (1 << bitsize) - 1
         super().__init__(getter, setter)
@@ -52,7 +53,7 @@ def bit_range(b, e, signed=False):
     def setter(s, v):
         s[b:e] = v
 
-    return _p2(getter, setter, e - b, signed)
+    return _p2(getter, setter, e - b, signed, b)
 
 
 def bit(b):
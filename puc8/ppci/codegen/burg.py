@@ -63,9 +63,12 @@ from ..lang.common import Token, SourceLocation
 from ..lang.tools import baselex, yacc
 from ..utils.tree import Tree
 
-# Generate parser on the fly:
+# Use the pregenerated parser, or generate it on the fly if it is out of date.
+# Regenerate with:
+#   python -m puc8.ppci.lang.tools.yacc puc8/ppci/codegen/burg.grammar \
+#       -o puc8/ppci/codegen/burg_parser.py
 spec_file = path.join(path.dirname(path.abspath(__file__)), "burg.grammar")
-burg_parser = yacc.load_as_module(spec_file)
+burg_parser = yacc.load_as_module(spec_file, precompiled=__package__ + ".burg_parser")
 
 
 class BurgLexer(baselex.BaseLexer):
@@ -0,0 +1,198 @@
+#!/usr/bin/python
+""" Automatically generated by yacc """
+from puc8.ppci.lang.tools.grammar import Production, Grammar
+from puc8.ppci.lang.tools.lr import LrParser, Reduce, Shift, Accept
+from puc8.ppci.lang.common import Token
+
+
+class Parser(LrParser):
+    def __init__(self):
+        grammar = Grammar()
+        grammar.add_terminals(['%%', '%terminal', '(', ')', ',', ':', ';', 'header', 'id', 'number', 'string'])
+        grammar.start_symbol = "burgdef"
+        grammar.add_production("burgdef", ('header', '%%', 'directives', '%%', 'rules'), self.action_burgdef_0)
+        grammar.add_production("directives", (), self.action_directives_1)
+        grammar.add_production("directives", ('directives', 'directive'), self.action_directives_2)
+        grammar.add_production("directive", ('termdef',), self.action_directive_3)
+        grammar.add_production("termdef", ('%terminal', 'termids'), self.action_termdef_4)
+        grammar.add_production("termids", (), self.action_termids_5)
+        grammar.add_production("termids", ('termids', 'termid'), self.action_termids_6)
+        grammar.add_production("termid", ('id',), self.action_termid_7)
+        grammar.add_production("rules", (), self.action_rules_8)
+        grammar.add_production("rules", ('rules', 'rule'), self.action_rules_9)
+        grammar.add_production("rule", ('id', ':', 'tree', 'cost', 'string'), self.action_rule_10)
+        grammar.add_production("rule", ('id', ':', 'tree', 'cost', 'string', 'string'), self.action_rule_11)
+        grammar.add_production("cost", ('number',), self.action_cost_12)
+        grammar.add_production("tree", ('id',), self.action_tree_13)
+        grammar.add_production("tree", ('id', '(', 'tree', ')'), self.action_tree_14)
+        grammar.add_production("tree", ('id', '(', 'tree', ',', 'tree', ')'), self.action_tree_15)
+        action_table = {}
+        action_table[(0, 'header')] = Shift(1)
+        action_table[(1, '%%')] = Shift(2)
+        action_table[(2, '%%')] = Reduce(1)
+        action_table[(2, '%terminal')] = Reduce(1)
+        action_table[(3, '%%')] = Shift(4)
+        action_table[(3, '%terminal')] = Shift(5)
+        action_table[(4, 'EOF')] = Reduce(8)
+        action_table[(4, 'id')] = Reduce(8)
+        action_table[(5, '%%')] = Reduce(5)
+        action_table[(5, '%terminal')] = Reduce(5)
+        action_table[(5, 'id')] = Reduce(5)
+        action_table[(6, '%%')] = Reduce(2)
+        action_table[(6, '%terminal')] = Reduce(2)
+        action_table[(7, '%%')] = Reduce(3)
+        action_table[(7, '%terminal')] = Reduce(3)
+        action_table[(8, 'EOF')] = Accept(0)
+        action_table[(8, 'id')] = Shift(10)
+        action_table[(9, '%%')] = Reduce(4)
+        action_table[(9, '%terminal')] = Reduce(4)
+        action_table[(9, 'id')] = Shift(12)
+        action_table[(10, ':')] = Shift(14)
+        action_table[(11, 'EOF')] = Reduce(9)
+        action_table[(11, 'id')] = Reduce(9)
+        action_table[(12, '%%')] = Reduce(7)
+        action_table[(12, '%terminal')] = Reduce(7)
+        action_table[(12, 'id')] = Reduce(7)
+        action_table[(13, '%%')] = Reduce(6)
+        action_table[(13, '%terminal')] = Reduce(6)
+        action_table[(13, 'id')] = Reduce(6)
+        action_table[(14, 'id')] = Shift(15)
+        action_table[(15, '(')] = Shift(17)
+        action_table[(15, 'number')] = Reduce(13)
+        action_table[(16, 'number')] = Shift(19)
+        action_table[(17, 'id')] = Shift(20)
+        action_table[(18, 'string')] = Shift(22)
+        action_table[(19, 'string')] = Reduce(12)
+        action_table[(20, '(')] = Shift(23)
+        action_table[(20, ')')] = Reduce(13)
+        action_table[(20, ',')] = Reduce(13)
+        action_table[(21, ')')] = Shift(24)
+        action_table[(21, ',')] = Shift(25)
+        action_table[(22, 'EOF')] = Reduce(10)
+        action_table[(22, 'id')] = Reduce(10)
+        action_table[(22, 'string')] = Shift(26)
+        action_table[(23, 'id')] = Shift(20)
+        action_table[(24, 'number')] = Reduce(14)
+        action_table[(25, 'id')] = Shift(28)
+        action_table[(26, 'EOF')] = Reduce(11)
+        action_table[(26, 'id')] = Reduce(11)
+        action_table[(27, ')')] = Shift(30)
+        action_table[(27, ',')] = Shift(31)
+        action_table[(28, '(')] = Shift(32)
+        action_table[(28, ')')] = Reduce(13)
+        action_table[(29, ')')] = Shift(33)
+        action_table[(30, ')')] = Reduce(14)
+        action_table[(30, ',')] = Reduce(14)
+        action_table[(31, 'id')] = Shift(28)
+        action_table[(32, 'id')] = Shift(20)
+        action_table[(33, 'number')] = Reduce(15)
+        action_table[(34, ')')] = Shift(36)
+        action_table[(35, ')')] = Shift(37)
+        action_table[(35, ',')] = Shift(38)
+        action_table[(36, ')')] = Reduce(15)
+        action_table[(36, ',')] = Reduce(15)
+        action_table[(37, ')')] = Reduce(14)
+        action_table[(38, 'id')] = Shift(28)
+        action_table[(39, ')')] = Shift(40)
+        action_table[(40, ')')] = Reduce(15)
+
+        goto_table = {}
+        goto_table[(2, 'directives')] = 3
+        goto_table[(3, 'directive')] = 6
+        goto_table[(3, 'termdef')] = 7
+        goto_table[(4, 'rules')] = 8
+        goto_table[(5, 'termids')] = 9
+        goto_table[(8, 'rule')] = 11
+        goto_table[(9, 'termid')] = 13
+        goto_table[(14, 'tree')] = 16
+        goto_table[(16, 'cost')] = 18
+        goto_table[(17, 'tree')] = 21
+        goto_table[(23, 'tree')] = 27
+        goto_table[(25, 'tree')] = 29
+        goto_table[(31, 'tree')] = 34
+        goto_table[(32, 'tree')] = 35
+        goto_table[(38, 'tree')] = 39
+
+        super().__init__(grammar, action_table, goto_table)
+
+    def action_burgdef_0(self, arg1, arg2, arg3, arg4, arg5):
+        res = None
+        self.system.header_lines = arg1.val
+        return res
+
+    def action_directives_1(self):
+        res = None
+        pass
+        return res
+
+    def action_directives_2(self, arg1, arg2):
+        res = None
+        pass
+        return res
+
+    def action_directive_3(self, arg1):
+        res = None
+        pass
+        return res
+
+    def action_termdef_4(self, arg1, arg2):
+        res = None
+        pass
+        return res
+
+    def action_termids_5(self):
+        res = None
+        pass
+        return res
+
+    def action_termids_6(self, arg1, arg2):
+        res = None
+        pass
+        return res
+
+    def action_termid_7(self, arg1):
+        res = None
+        self.system.add_terminal(arg1.val)
+        return res
+
+    def action_rules_8(self):
+        res = None
+        pass
+        return res
+
+    def action_rules_9(self, arg1, arg2):
+        res = None
+        pass
+        return res
+
+    def action_rule_10(self, arg1, arg2, arg3, arg4, arg5):
+        res = None
+        self.system.add_rule(arg1.val, arg3, arg4, None, arg5.val)
+        return res
+
+    def action_rule_11(self, arg1, arg2, arg3, arg4, arg5, arg6):
+        res = None
+        self.system.add_rule(arg1.val, arg3, arg4, arg5.val, arg6.val)
+        return res
+
+    def action_cost_12(self, arg1):
+        res = None
+        return arg1.val
+        return res
+
+    def action_tree_13(self, arg1):
+        res = None
+        return self.system.tree(arg1.val)
+        return res
+
+    def action_tree_14(self, arg1, arg2, arg3, arg4):
+        res = None
+        return self.system.tree(arg1.val, arg3)
+        return res
+
+    def action_tree_15(self, arg1, arg2, arg3, arg4, arg5, arg6):
+        res = None
+        return self.system.tree(arg1.val, arg3, arg5)
+        return res
+
+spec_digest = "00942f2272129c090d0e07e63ed6156e7ebe4e93c59d071e1f88351b5bb052da"
@@ -243,6 +243,9 @@ class InstructionSelector1:
 
     verbose = False
 
+    # Burm tables and tree selectors by architecture and weights
+    systems = {}
+
     def __init__(self, arch, sgraph_builder, reporter, weights=(1, 1, 1)):
         """Create a new instruction selector.
 
@@ -258,7 +261,15 @@ class InstructionSelector1:
         self.reporter = reporter
         self.dag_splitter = DagSplitter(arch)
 
-        # Generate burm table of rules:
+        # The burm table of rules only depends on the architecture and
+        # the weights, so it is generated once and shared:
+        key = (arch, weights)
+        if key not in self.systems:
+            self.systems[key] = self._create_system(weights)
+        self.sys, self.tree_selector = self.systems[key]
+
+    def _create_system(self, weights):
+        """ Generate burm table of rules and a tree selector for it """
         self.sys = BurgSystem()
 
         for terminal in terminals:
@@ -272,7 +283,7 @@ class InstructionSelector1:
         self._create_undefined_rules()
 
         # Add all isa patterns:
-        for pattern in arch.isa.patterns:
+        for pattern in self.arch.isa.patterns:
             cost = (
                 pattern.size * weights[0]
                 + pattern.cycles * weights[1]
@@ -287,7 +298,7 @@ class InstructionSelector1:
             )
 
         self.sys.check()
-        self.tree_selector = TreeSelector(self.sys)
+        return self.sys, TreeSelector(self.sys)
 
     def _create_undefined_rules(self):
         """Create rules for undefined values based on register classes."""
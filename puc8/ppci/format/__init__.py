@@ -1,7 +1,20 @@
 """ Package for different file formats """
 
-from .elf import ElfFile
-from .hexfile import HexFile
+import importlib
+
+# The format modules are imported on first use, so that importing a single
+# format does not load the others.
+_lazy = {"HexFile": ".hexfile", "ElfFile": ".elf"}
+
+
+def __getattr__(name):
+    if name in _lazy:
+        module = importlib.import_module(_lazy[name], __name__)
+        value = globals()[name] = getattr(module, name)
+        return value
+    raise AttributeError(
+        "module {!r} has no attribute {!r}".format(__name__, name)
+    )
 
 
 __all__ = ("HexFile", "ElfFile")
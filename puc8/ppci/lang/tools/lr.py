@@ -309,9 +309,12 @@ class LrParserBuilder:
 
         addSt(iis)
 
+        # Visit symbols in a fixed order, so that states are numbered the
+        # same way every time
+        symbols = sorted(self.grammar.symbols)
         while worklist:
             itemset = worklist.pop(0)
-            for symbol in self.grammar.symbols:
+            for symbol in symbols:
                 nis = self.next_item_set(itemset, symbol)
                 if not nis:
                     continue
@@ -367,7 +370,7 @@ class LrParserBuilder:
         self.logger.debug("Number of transitions: {}".format(len(transitions)))
 
         # Fill action table:
-        for state in states:
+        for state in sorted(states, key=indici.get):
             state_nr = indici[state]
             # Detect conflicts:
             for item in state:
@@ -392,7 +395,7 @@ class LrParserBuilder:
                     self.set_action(state_nr, item.look_ahead, act)
 
             # Fill the goto table:
-            for nt in self.grammar.nonterminals:
+            for nt in sorted(self.grammar.nonterminals):
                 key = (state_nr, nt)
                 if key in transitions:
                     self.goto_table[key] = transitions[key]
@@ -4,8 +4,11 @@
 
 import types
 import io
-import datetime
+import sys
 import logging
+import hashlib
+import argparse
+import importlib
 
 from .baselex import BaseLexer, EOF
 from ..common import Token, SourceLocation
@@ -125,10 +128,13 @@ class XaccGenerator:
         print(*args, file=self.output_file)
 
     def generate_python_script(self):
-        """ Generate python script with the parser table """
+        """Generate python script with the parser table.
+
+        The output only depends on the grammar, so that regenerating a
+        checked-in parser gives the same file.
+        """
         self.print("#!/usr/bin/python")
-        stamp = datetime.datetime.now().ctime()
-        self.print('""" Automatically generated on {} """'.format(stamp))
+        self.print('""" Automatically generated by yacc """')
         self.print("from puc8.ppci.lang.tools.grammar import Production, Grammar")
         self.print(
             "from puc8.ppci.lang.tools.lr import LrParser, Reduce, Shift, Accept"
@@ -143,7 +149,9 @@ class XaccGenerator:
         # Generate rules:
         self.print("        grammar = Grammar()")
         self.print(
-            "        grammar.add_terminals({})".format(self.grammar.terminals)
+            "        grammar.add_terminals({})".format(
+                sorted(self.grammar.terminals)
+            )
         )
         self.print(
             '        grammar.start_symbol = "{}"'.format(
@@ -159,14 +167,14 @@ class XaccGenerator:
             )
         # Fill action table:
         self.print("        action_table = {}")
-        for state in self.action_table:
+        for state in sorted(self.action_table):
             action = self.action_table[state]
             self.print("        action_table[{}] = {}".format(state, action))
         self.print("")
 
         # Fill goto table:
         self.print("        goto_table = {}")
-        for state_number in self.goto_table:
+        for state_number in sorted(self.goto_table):
             to = self.goto_table[state_number]
             self.print("        goto_table[{}] = {}".format(state_number, to))
         self.print("")
@@ -219,14 +227,62 @@ def transform(f_in, f_out):
     generator.generate(grammar, parser.headers, f_out)
 
 
-def load_as_module(filename):
-    """ Load a parser spec file, generate LR tables and create module """
-    ob = io.StringIO()
+def digest(src):
+    """ Hash of a parser spec, used to check generated parser modules """
+    return hashlib.sha256(src.encode("utf-8")).hexdigest()
+
+
+def generate_module(f_in, f_out):
+    """Generate a parser module from a spec file, which load_as_module
+    can use instead of generating the LR tables again."""
+    src = f_in.read()
+    f_in.close()
+    transform(io.StringIO(src), f_out)
+    print('spec_digest = "{}"'.format(digest(src)), file=f_out)
+
+
+def load_as_module(filename, precompiled=None):
+    """Load a parser spec file, generate LR tables and create module.
+
+    When precompiled names a module generated from the same spec by
+    generate_module, that module is imported instead.
+    """
     if hasattr(filename, "read"):
-        transform(filename, ob)
+        src = filename.read()
     else:
-        transform(open(filename), ob)
+        with open(filename) as f:
+            src = f.read()
+
+    if precompiled:
+        try:
+            parser_mod = importlib.import_module(precompiled)
+        except ImportError:
+            parser_mod = None
+        if getattr(parser_mod, "spec_digest", None) == digest(src):
+            return parser_mod
+
+    ob = io.StringIO()
+    transform(io.StringIO(src), ob)
 
     parser_mod = types.ModuleType("generated_parser")
     exec(ob.getvalue(), parser_mod.__dict__)
     return parser_mod
+
+
+def make_argument_parser():
+    """ Constructs an argument parser """
+    parser = argparse.ArgumentParser(
+        description="xacc compiler compiler"
+    )
+    parser.add_argument(
+        "source", type=argparse.FileType("r"), help="the parser specification"
+    )
+    parser.add_argument(
+        "-o", "--output", type=argparse.FileType("w"), default=sys.stdout
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    args = make_argument_parser().parse_args()
+    generate_module(args.source, args.output)
@@ -0,0 +1,95 @@
+"""Execution profiler for ENG1448 8-bit processor simulator
+   (c) 2020-2023 Wouter Caarls, PUC-Rio
+"""
+
+import sys
+
+from .simulator import B, BGE, CALL, POP
+
+class Profile:
+    """Execution counts gathered while simulating.
+
+    Instructions are attributed to functions using a shadow call stack,
+    where a function is identified by the address of its first instruction.
+    Code executed outside of any call is attributed to address 0."""
+    def __init__(self):
+        self.cycles = 0
+        self.counts = [0] * 256
+        self.taken = [0] * 256
+        self.nottaken = [0] * 256
+        self.calls = {}
+        self.returns = 0
+        self.exclusive = {0: 0}
+        self.inclusive = {}
+        self.stack = [(0, 0)]
+
+    def record(self, pc, inst, state):
+        """Records the execution of an instruction at pc, given the state after execution."""
+        self.cycles += 1
+        self.counts[pc] += 1
+        fn = self.stack[-1][0]
+        self.exclusive[fn] += 1
+
+        m = inst.op
+        if B <= m <= BGE:
+            if state.regs[15] == (pc + 1)&255:
+                self.nottaken[pc] += 1
+            else:
+                self.taken[pc] += 1
+        elif m == CALL:
+            callee = state.regs[15]
+            self.calls[(fn, callee)] = self.calls.get((fn, callee), 0) + 1
+            self.exclusive.setdefault(callee, 0)
+            self.stack.append((callee, self.cycles))
+        elif m == POP and inst.rd == 15 and len(self.stack) > 1:
+            callee, start = self.stack.pop()
+            self.inclusive[callee] = self.inclusive.get(callee, 0) + self.cycles - start
+            self.returns += 1
+
+    def report(self, sim, f=sys.stdout, top=20):
+        """Prints hot spots, per-function and call-graph profiles."""
+        labels = {}
+        if sim.disassembler.map is not None:
+            labels = sim.disassembler.map['code']
+
+        def name(addr):
+            return labels.get(addr, f'{addr}')
+
+        def where(addr):
+            """Returns nearest preceding label and offset for an address."""
+            for a in range(addr, -1, -1):
+                if a in labels:
+                    return labels[a] if a == addr else f'{labels[a]}+{addr-a}'
+            return ''
+
+        total = max(self.cycles, 1)
+
+        # Functions that did not return yet count until now
+        inclusive = dict(self.inclusive)
+        for callee, start in self.stack[1:]:
+            inclusive[callee] = inclusive.get(callee, 0) + self.cycles - start
+        inclusive[0] = self.cycles
+
+        print(f'\nExecuted {self.cycles} cycles, {sum(self.calls.values())} calls, {self.returns} returns', file=f)
+
+        print(f'\nHot spots:', file=f)
+        print(f'{"addr":>4} {"count":>10} {"%":>6} {"taken":>8} {"not":>8}  {"location":20} instruction', file=f)
+        hot = sorted((a for a in range(256) if self.counts[a]), key=lambda a: -self.counts[a])
+        for a in hot[:top]:
+            _, dis = sim.disassembler.process(sim.code[a])
+            if self.taken[a] or self.nottaken[a]:
+                branches = f'{self.taken[a]:8} {self.nottaken[a]:8}'
+            else:
+                branches = ' ' * 17
+            print(f'{a:4} {self.counts[a]:10} {100*self.counts[a]/total:6.2f} {branches}  {where(a):20} {dis}', file=f)
+
+        print(f'\nFunctions:', file=f)
+        print(f'{"function":20} {"calls":>8} {"self":>10} {"%":>6} {"inclusive":>10} {"%":>6}', file=f)
+        for fn in sorted(self.exclusive, key=lambda fn: -self.exclusive[fn]):
+            calls = sum(c for (caller, callee), c in self.calls.items() if callee == fn)
+            print(f'{name(fn):20} {calls:8} {self.exclusive[fn]:10} {100*self.exclusive[fn]/total:6.2f} '
+                  f'{inclusive.get(fn, 0):10} {100*inclusive.get(fn, 0)/total:6.2f}', file=f)
+
+        print(f'\nCall graph:', file=f)
+        for (caller, callee), c in sorted(self.calls.items(), key=lambda e: -e[1]):
+            print(f'{name(caller):>20} -> {name(callee):20} {c:8}', file=f)
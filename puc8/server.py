@@ -0,0 +1,212 @@
+"""Compiler server for ENG1448 8-bit processor
+   (c) 2020-2023 Wouter Caarls, PUC-Rio
+
+Compiles C programs on request, without paying for interpreter startup,
+imports and instruction selector construction every time. Requests and
+responses are JSON objects, one per line. A request has the fields
+
+    id      Returned unchanged in the response
+    file    C source file, or the name of the source if given inline
+    source  C source code (optional, read from file if not given)
+    output  One of 'vhdl' (default), 'asm', 'map' or 'listing'
+    O       Optimization level (default 2)
+
+and is answered by either {"id", "ok": true, "output", "warnings", "time"}
+or {"id", "ok": false, "error", "warnings", "time"}. Requests are compiled
+in parallel, so responses may arrive in a different order.
+"""
+
+import io, os, sys, json, stat, time, socket, logging, threading
+from concurrent.futures import ProcessPoolExecutor
+
+from .compiler import compile, compile_image
+from .assembler import Preprocessor, Assembler
+from .emitter import emitvhdl, emitmap, emitlisting
+from .ppci.common import CompilerError
+
+# Supported outputs
+outputs = ('vhdl', 'asm', 'map', 'listing')
+
+def warm():
+    """Compiles an empty program, such that the C frontend, architecture
+    and instruction selector tables are ready for the next one."""
+    compile_image(io.StringIO('void main() {}'), 2)
+
+def diagnose(e):
+    """Returns an error message for an exception raised while compiling."""
+    if isinstance(e, CompilerError):
+        if e.loc is not None and e.loc.filename:
+            return f'{e.loc.filename}:{e.loc.row}:{e.loc.col}: {e.msg}'
+        return e.msg
+    return f'{type(e).__name__}: {e}'
+
+class Warnings(logging.Handler):
+    """Collects the warnings logged by ppci."""
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(self.format(record))
+
+def check(request):
+    """Raises a ValueError if a request is malformed, so that it is answered
+    without being sent to a worker."""
+    if not isinstance(request, dict):
+        raise ValueError('Request must be an object')
+    if 'source' in request:
+        if not isinstance(request['source'], str):
+            raise ValueError('source must be a string')
+    elif not isinstance(request.get('file'), str):
+        raise ValueError('Request needs a file or source')
+    if 'file' in request and not isinstance(request['file'], str):
+        raise ValueError('file must be a string')
+    if request.get('output', 'vhdl') not in outputs:
+        raise ValueError(f'Unknown output {request["output"]!r}, expected one of {", ".join(outputs)}')
+    if request.get('O', 2) not in (0, 1, 2) or isinstance(request.get('O'), bool):
+        raise ValueError(f'Unknown optimization level {request["O"]!r}, expected 0, 1 or 2')
+
+def error(id, message, start):
+    """Returns the response to a request that failed outside the compiler."""
+    return {'id': id, 'ok': False, 'error': message, 'warnings': [],
+            'time': time.perf_counter() - start}
+
+def handle(request):
+    """Compiles a single request, returning the response instead of raising."""
+    start = time.perf_counter()
+    response = {'id': request.get('id')}
+    warnings = Warnings()
+    logging.getLogger().addHandler(warnings)
+    try:
+        output = request.get('output', 'vhdl')
+        if 'source' in request:
+            src = io.StringIO(request['source'])
+            # Includes are searched relative to the source file
+            src.name = request.get('file', '<source>')
+        else:
+            src = open(request['file'], 'r')
+
+        with src:
+            if output == 'asm':
+                asm = Preprocessor().process(io.StringIO(compile(src, request.get('O', 2))))
+                mem = Assembler().process(asm)
+            else:
+                mem = compile_image(src, request.get('O', 2))
+
+        f = io.StringIO()
+        if output == 'asm':
+            for (idx, label, inst, _, _, _) in asm:
+                print((label + ': ' if label != '' else '') + inst, file=f)
+        elif output == 'vhdl':
+            emitvhdl(mem, f)
+        elif output == 'map':
+            emitmap(mem, f)
+        else:
+            emitlisting(mem, f)
+        response.update(ok=True, output=f.getvalue())
+    except Exception as e:
+        response.update(ok=False, error=diagnose(e))
+    finally:
+        logging.getLogger().removeHandler(warnings)
+    response['warnings'] = warnings.messages
+    response['time'] = time.perf_counter() - start
+    return response
+
+class Server():
+    """Compiles requests in a pool of worker processes."""
+    def __init__(self, jobs=None):
+        if jobs is None:
+            jobs = os.cpu_count() or 1
+
+        # Forked workers start out warm, others warm up when started
+        warm()
+        self.executor = ProcessPoolExecutor(jobs, initializer=warm)
+
+        # Start all workers now instead of on the first requests
+        for future in [self.executor.submit(int) for _ in range(jobs)]:
+            future.result()
+
+    def serve(self, fin, fout):
+        """Answers the requests read from fin until it is closed."""
+        lock = threading.Lock()
+        pending = []
+
+        def respond(response):
+            with lock:
+                print(json.dumps(response), file=fout, flush=True)
+
+        def done(future, id, start):
+            if future.exception() is not None:
+                # The worker itself failed
+                respond(error(id, diagnose(future.exception()), start))
+            else:
+                respond(future.result())
+
+        for line in fin:
+            if line.strip() == '':
+                continue
+            start = time.perf_counter()
+            request = None
+            try:
+                request = json.loads(line)
+                check(request)
+            except ValueError as e:
+                id = request.get('id') if isinstance(request, dict) else None
+                respond(error(id, f'Invalid request: {e}', start))
+                continue
+
+            future = self.executor.submit(handle, request)
+            future.add_done_callback(lambda future, id=request.get('id'), start=start: done(future, id, start))
+            pending.append(future)
+
+        for future in pending:
+            future.exception()
+
+    def listen(self, path):
+        """Answers requests on connections to a Unix socket until interrupted."""
+        unlink(path)
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.bind(path)
+            s.listen()
+            try:
+                while True:
+                    conn, _ = s.accept()
+                    threading.Thread(target=self._connection, args=(conn,), daemon=True).start()
+            finally:
+                os.unlink(path)
+
+    def _connection(self, conn):
+        with conn, conn.makefile('r') as fin, conn.makefile('w') as fout:
+            try:
+                self.serve(fin, fout)
+            except OSError:
+                # Client went away
+                pass
+
+    def close(self):
+        self.executor.shutdown()
+
+def unlink(path):
+    """Removes a socket left behind by an earlier server. Raises a
+    ValueError if path is anything else, such as a source file."""
+    if os.path.lexists(path):
+        if not stat.S_ISSOCK(os.lstat(path).st_mode):
+            raise ValueError(f'{path} exists and is not a socket')
+        os.unlink(path)
+
+def serve(path='-', jobs=None):
+    """Runs a compiler server on stdin and stdout, or on a Unix socket."""
+    if path != '-':
+        # Fail before starting the workers
+        unlink(path)
+    server = Server(jobs)
+    try:
+        if path == '-':
+            server.serve(sys.stdin, sys.stdout)
+        else:
+            server.listen(path)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
@@ -2,20 +2,87 @@
    (c) 2020-2023 Wouter Caarls, PUC-Rio
 """
 
-import copy
-from .disassembler import Disassembler
+import re, copy
+from collections import namedtuple, deque
+from .disassembler import Disassembler, lookup
+from .devices import console, Watchpoint
+
+# Operation identifiers for decoded instructions
+(ILL, LDR, STR, MOV, B, BZ, BNZ, BCS, BCC, BLT, BGE,
+ PUSH, CALL, POP, ADD, SUB, SHL, SHR, AND, ORR, EOR) = range(21)
+
+ops = {'ldr': LDR, 'str': STR, 'mov': MOV,
+       'b': B, 'bz': BZ, 'beq': BZ, 'bnz': BNZ, 'bne': BNZ,
+       'bcs': BCS, 'bhs': BCS, 'bcc': BCC, 'blo': BCC, 'blt': BLT, 'bge': BGE,
+       'push': PUSH, 'call': CALL, 'pop': POP, 'ret': POP,
+       'add': ADD, 'sub': SUB, 'shl': SHL, 'shr': SHR,
+       'and': AND, 'orr': ORR, 'eor': EOR}
+
+Instruction = namedtuple('Instruction', ['op', 'rd', 'rs', 'rt', 'c4i', 'c4', 'c8', 'imm'])
+Result = namedtuple('Result', ['state', 'cycles', 'reason'])
+
+def decode(word):
+    """Decodes a 17-bit instruction word (or binary string) into an Instruction record."""
+    if isinstance(word, str):
+        word = int(word, 2)
+
+    pattern = lookup(word)
+    if pattern is None:
+        return Instruction(ILL, 0, 0, 0, 0, 0, 0, False)
+
+    m = pattern[0]
+    c4 = word & 15
+    return Instruction(ops[m], word >> 8 & 15, word >> 4 & 15, c4,
+                       c4 | 240 if c4 > 7 else c4, c4, word & 255, bool(word >> 12 & 1))
+
+# Names that may be used in breakpoint conditions, besides registers
+_names = {'fp': 'regs[13]', 'sp': 'regs[14]', 'pc': 'regs[15]',
+          'zero': 'state.zero', 'carry': 'state.carry',
+          'negative': 'state.negative', 'overflow': 'state.overflow',
+          'and': 'and', 'or': 'or', 'not': 'not'}
+
+def condition(expr):
+    """Compiles a breakpoint condition such as 'r3 == 7 and [sp+1] != 0'
+    into a predicate on the machine state."""
+    def token(m):
+        if m[0][0].isdigit():
+            return m[0]
+        if m[0] == '[':
+            return 'mem[('
+        if m[0] == ']':
+            return ')&255]'
+        if re.fullmatch(r'r\d+', m[0]) and int(m[0][1:]) < 16:
+            return f'regs[{m[0][1:]}]'
+        if m[0] not in _names:
+            raise ValueError(f'Unknown name {m[0]} in condition')
+        return _names[m[0]]
+
+    src = re.sub(r'\w+|\[|\]', token, expr)
+    code = compile(src, '<condition>', 'eval')
+
+    def predicate(state):
+        return eval(code, {'__builtins__': {}}, {'state': state, 'regs': state.regs, 'mem': state.mem})
+
+    return predicate
 
 class State:
     """Machine state for simulator."""
     def __init__(self):
-        self.regs = [0 for i in range(16)]
-        self.mem = [0 for i in range(256)]
+        self.regs = bytearray(16)
+        self.mem = bytearray(256)
         self.regs[14] = 255
         self.zero = False
         self.carry = False
         self.negative = False
         self.overflow = False
 
+    def copy(self):
+        """Returns an independent copy of this state."""
+        state = copy.copy(self)
+        state.regs = self.regs[:]
+        state.mem = self.mem[:]
+        return state
+
     def diff(self, state):
         """Calculates difference between this state and another."""
         d = ''
@@ -49,126 +116,309 @@ class State:
 
         return s
 
+def _flags(state):
+    """Packs flags into an integer."""
+    return state.zero | state.carry << 1 | state.negative << 2 | state.overflow << 3
+
+def _restore(state, regs, flags):
+    """Restores registers and flags."""
+    state.regs[:] = regs
+    state.zero = bool(flags & 1)
+    state.carry = bool(flags & 2)
+    state.negative = bool(flags & 4)
+    state.overflow = bool(flags & 8)
+
+class History:
+    """Bounded execution history supporting reverse execution.
+
+    Before every step, an undo record with the registers, flags and the
+    single memory cell the instruction may write is kept for the last
+    depth steps. Every interval steps, a compact snapshot of the complete
+    state is taken, of which the last count are kept. Reverse execution
+    first uses the undo records. When these run out, it restores the most
+    recent earlier snapshot and replays forward to the previous step.
+
+    The outcome of every I/O device access (the register loaded, or the
+    memory cell after a store, as devices may keep their value) is logged,
+    so that replay gives the same results without accessing the devices
+    again."""
+    def __init__(self, sim, depth=100000, interval=10000, count=100):
+        self.sim = sim
+        self.steps = 0
+        self.interval = interval
+        self.undo = deque(maxlen=depth)
+        self.snapshots = deque(maxlen=count)
+        self.log = {}
+        self.pending = None
+
+    def _address(self, state, inst):
+        """Returns the data address an instruction accesses, or -1."""
+        m = inst.op
+        if m == LDR or m == STR:
+            return inst.c8 if inst.imm else (state.regs[inst.rs] + inst.c4i)&255
+        elif m == PUSH or m == CALL:
+            return state.regs[14]
+        return -1
+
+    def record(self, state, inst):
+        """Records state before executing decoded instruction."""
+        regs = state.regs
+        if self.pending is not None:
+            # Previous step accessed a device
+            step, m, index = self.pending
+            self.log[step] = regs[index] if m == LDR else state.mem[index]
+            self.pending = None
+
+        if self.steps % self.interval == 0 and not (self.snapshots and self.snapshots[-1][0] == self.steps):
+            self.snapshots.append((self.steps, bytes(regs), bytes(state.mem), _flags(state)))
+            # Device accesses before the oldest snapshot are never replayed
+            for step in [step for step in self.log if step < self.snapshots[0][0]]:
+                del self.log[step]
+
+        m = inst.op
+        addr = self._address(state, inst)
+        if (m == LDR or m == STR) and self.sim.io[addr] is not None:
+            self.pending = (self.steps, m, inst.rd if m == LDR else addr)
+        if m == LDR:
+            addr = -1
+
+        self.undo.append((bytes(regs), _flags(state), addr, state.mem[addr]))
+        self.steps += 1
+
+    def replay(self, state, steps):
+        """Executes steps instructions, using the logged outcome of device
+        accesses instead of accessing the devices."""
+        sim = self.sim
+        for _ in range(steps):
+            regs = state.regs
+            inst = sim.rom[regs[15]]
+            addr = self._address(state, inst)
+            if inst.op in (LDR, STR) and sim.io[addr] is not None:
+                step = self.steps
+                self.record(state, inst)
+                regs[15] = (regs[15] + 1)&255
+                if inst.op == LDR:
+                    regs[inst.rd] = self.log[step]
+                else:
+                    state.mem[addr] = self.log[step]
+                self.pending = None
+            else:
+                self.record(state, inst)
+                sim._step(inst, state)
+
+    def reverse(self, state):
+        """Undoes the last step, returning False if there is no more history."""
+        # The last step is undone, so its device access does not matter
+        self.pending = None
+        if self.undo:
+            regs, flags, addr, val = self.undo.pop()
+            _restore(state, regs, flags)
+            if addr >= 0:
+                state.mem[addr] = val
+            self.steps -= 1
+        else:
+            # Undo records exhausted; go back to an earlier snapshot and
+            # replay until the previous step
+            earlier = [s for s in self.snapshots if s[0] < self.steps]
+            if not earlier:
+                return False
+            target = self.steps - 1
+            self.steps, regs, mem, flags = earlier[-1]
+            _restore(state, regs, flags)
+            state.mem[:] = mem
+            while self.snapshots[-1][0] > self.steps:
+                self.snapshots.pop()
+            self.replay(state, target - self.steps)
+
+        # Snapshots in the future are no longer valid
+        while self.snapshots and self.snapshots[-1][0] > self.steps:
+            self.snapshots.pop()
+        return True
+
 class Simulator:
     """Simulates machine code."""
-    def __init__(self, map = None):
+    def __init__(self, map = None, devices = None):
         self.disassembler = Disassembler(map)
+        self.decoded = {}
+        self.code = []
+        self.rom = []
+        self.io = [None] * 256
+        self.profile = None
+        self.trace = None
+
+        if devices is None:
+            devices = console()
+        for addr, device in devices.items():
+            self.attach(addr, device)
 
-    def execute(self, bin, state):
-        """Returns machine state after executing instruction."""
-        # Disassemble instruction
-        m, dis = self.disassembler.process(bin)
-
-        opcode = bin[0:5]
-        imm = int(opcode[4], 2)
-        r1 = int(bin[5:9], 2)
-        r2 = int(bin[9:13], 2)
-        r3 = int(bin[13:17], 2)
-        c4i = int(bin[13]*4 + bin[13:17], 2)
-        c4 = int(bin[13:17], 2)
-        c8 = int(bin[9:17], 2)
-        next = copy.deepcopy(state)
-        next.regs[15] += 1
+    def attach(self, addr, device):
+        """Maps an I/O device at a data memory address (None detaches)."""
+        self.io[addr] = device
+
+    def decode(self, word):
+        """Returns decoded instruction, caching the result."""
+        inst = self.decoded.get(word)
+        if inst is None:
+            inst = decode(word)
+            self.decoded[word] = inst
+        return inst
+
+    def load(self, mem):
+        """Decodes code section and returns initial machine state."""
+        # Unused ROM addresses are zero, as in the VHDL image
+        self.code = list(mem.code[:256])
+        self.code += [0] * (256 - len(self.code))
+        self.rom = [self.decode(word) for word in self.code]
+
+        state = State()
+        data = mem.data[:256]
+        state.mem[:len(data)] = data
 
+        return state
+
+    def patch(self, addr, word):
+        """Replaces the instruction at a ROM address."""
+        if isinstance(word, str):
+            word = int(word, 2)
+        self.code[addr] = word
+        self.rom[addr] = self.decode(word)
+
+    def execute(self, word, state):
+        """Returns machine state after executing instruction word (or binary string)."""
+        next = state.copy()
+        self._step(self.decode(word), next)
+        return next
+
+    def step(self, state):
+        """Executes the instruction at the current PC, modifying state in place."""
+        pc = state.regs[15]
+        inst = self.rom[pc]
+        self._step(inst, state)
+        if self.profile is not None:
+            self.profile.record(pc, inst, state)
+        if self.trace is not None:
+            self.trace.record(pc, inst, state)
+
+    def _step(self, inst, state):
+        """Executes decoded instruction, modifying state in place."""
+        m, r1, r2, r3, c4i, c4, c8, imm = inst
+        regs = state.regs
+        mem = state.mem
+
+        # Read operands before the PC is incremented
+        pc = regs[15]
+        d = regs[r1]
+        a = regs[r2]
         if imm:
             addr = c8
-            if opcode[1] == '0':
+            if m < AND:
                 val = c4
             else:
                 val = (1<<c4)
         else:
-            addr = (state.regs[r2] + c4i)&255
-            val = state.regs[r3]
-
-        # Simulate instructions
-        if m == 'ldr':
-            if addr == 2:
-                inp = input('Enter keyboard character: ')
-                if len(inp) > 0:
-                    next.regs[r1] = ord(inp[0])
-                else:
-                    next.regs[r1] = 0
+            addr = (a + c4i)&255
+            val = regs[r3]
+
+        regs[15] = (pc + 1)&255
+
+        # Simulate instructions. ILL is numbered among the branches, so it
+        # must be tested first
+        if m == ILL:
+            raise ValueError(f'Illegal instruction at address {pc}')
+        elif m == LDR:
+            dev = self.io[addr]
+            if dev is None:
+                regs[r1] = mem[addr]
+            else:
+                regs[r1] = dev.read(state, addr)
+        elif m == STR:
+            dev = self.io[addr]
+            if dev is None:
+                mem[addr] = d
             else:
-                next.regs[r1] = state.mem[addr]
-        elif m == 'str':
-            if addr == 7:
-                print(chr(state.regs[r1]), end='')
-            elif addr == 8 and state.regs[r1] == 1:
-                print()
+                dev.write(state, addr, d)
+        elif m == MOV:
+            if imm:
+                regs[r1] = c8
             else:
-                next.mem[addr] = state.regs[r1]
-        elif m == 'mov':
-            if opcode == '00100':
-                next.regs[r1] = state.regs[r2]
-            elif opcode == '00101':
-                next.regs[r1] = c8
-            next.zero = (next.regs[r1] == 0)
-            next.carry = False
-            next.negative = bool(next.regs[r1] & 128)
-            next.overflow = False
-        elif opcode[:4] == '0011':
+                regs[r1] = a
+            state.zero = (regs[r1] == 0)
+            state.carry = False
+            state.negative = bool(regs[r1] & 128)
+            state.overflow = False
+        elif m <= BGE:
             # Direct jumps
-            if ( m == 'b' or
-                (m == 'bz' and state.zero) or (m == 'bnz' and not state.zero) or
-                (m == 'bcs' and state.carry) or (m == 'bcc' and not state.carry) or
-                (m == 'blt' and (state.overflow != state.negative)) or
-                (m == 'bge' and (state.overflow == state.negative))):
-                if opcode[-1] == '0':
+            if ( m == B or
+                (m == BZ and state.zero) or (m == BNZ and not state.zero) or
+                (m == BCS and state.carry) or (m == BCC and not state.carry) or
+                (m == BLT and (state.overflow != state.negative)) or
+                (m == BGE and (state.overflow == state.negative))):
+                if not imm:
                     # Uses incremented PC
-                    next.regs[15] = (next.regs[r2] + c4i)&255
+                    regs[15] = (regs[r2] + c4i)&255
                 else:
-                    next.regs[15] = c8
-        elif m == 'push':
-            if state.regs[14] == -1:
+                    regs[15] = c8
+        elif m == PUSH:
+            if regs[14] == 0:
                 raise RuntimeError('Stack overflow')
-            next.mem[state.regs[14]] =  state.regs[r1]
-            next.regs[14] -= 1
-        elif m == 'pop' or m == 'ret':
-            if state.regs[14] == 255:
+            mem[regs[14]] = d
+            regs[14] -= 1
+        elif m == POP:
+            sp = regs[14]
+            if sp == 255:
                 raise RuntimeError('Stack underflow')
-            next.regs[r1] = state.mem[state.regs[14]+1]
-            next.regs[14] += 1
-        elif m == 'call':
-            if state.regs[14] == -1:
+            regs[r1] = mem[sp+1]
+            regs[14] = (regs[14] + 1)&255
+        elif m == CALL:
+            sp = regs[14]
+            if sp == 0:
                 raise RuntimeError('Stack overflow')
-            next.mem[state.regs[14]] = state.regs[15]+1
-            next.regs[15] = c8
-            next.regs[14] -= 1
+            mem[sp] = (pc + 1)&255
+            if imm:
+                regs[15] = c8
+            else:
+                regs[15] = a
+            regs[14] = sp - 1
         else:
             # ALU instructions (modify flags)
-            next.overflow = 0
-            if m == 'add':
-                res = state.regs[r2] + val
-                next.overflow = bool((~(state.regs[r2] ^ val) & (state.regs[r2] ^ res)) & 128)
-            elif m == 'sub':
-                res = state.regs[r2] + (256-val)
-                next.overflow = bool(( (state.regs[r2] ^ val) & (state.regs[r2] ^ res)) & 128)
-            elif m == 'shl':
-                res = state.regs[r2] << 1
-            elif m == 'shr':
-                res = state.regs[r2] >> 1
-            elif m == 'and':
-                res = state.regs[r2] & val
-            elif m == 'orr':
-                res = state.regs[r2] | val
-            elif m == 'eor':
-                res = state.regs[r2] ^ val
+            state.overflow = False
+            if m == ADD:
+                res = a + val
+                state.overflow = bool((~(a ^ val) & (a ^ res)) & 128)
+            elif m == SUB:
+                res = a + (256-val)
+                state.overflow = bool(( (a ^ val) & (a ^ res)) & 128)
+            elif m == SHL:
+                res = a << 1
+            elif m == SHR:
+                res = a >> 1
+            elif m == AND:
+                res = a & val
+            elif m == ORR:
+                res = a | val
             else:
-                raise ValueError(f'Unknown opcode {opcode}')
-
-            next.zero = ((res&255) == 0)
-            next.carry = bool(res & 256)
-            next.negative = bool(res & 128)
-            next.regs[r1] = res&255
+                res = a ^ val
 
-        return next
+            state.zero = ((res&255) == 0)
+            state.carry = bool(res & 256)
+            state.negative = bool(res & 128)
+            regs[r1] = res&255
 
     def help(self):
         print("""Available commands:
    h       This help.
    n       Advance to next instruction.
    b a     Set or clear breakpoint at address a.
+   b a if e
+           Set breakpoint at address a that only stops when expression e
+           is true, e.g. b 42 if r3 == 7 and [sp+1] != 0.
+   w a     Set or clear watchpoint on ldr/str writes to memory address a.
+   wr a    Set or clear watchpoint on ldr/str reads from memory address a.
+   wa a    Set or clear watchpoint on any ldr/str access to memory address a.
+           Setting another kind of watchpoint on a watched address changes it.
    c       Execute continuously until halted.
+   rs [n]  Reverse by n instructions (default 1).
+   rc      Reverse continuously until breakpoint or start of history.
    p       Print current state.
    q       Exit simulator.
    rx      Print contents of register x.
@@ -179,54 +429,114 @@ class Simulator:
 
     def process(self, mem):
         """Simulate machine code."""
-        state = State()
-        for i, c in enumerate(mem['data']):
-            state.mem[i] = int(c[0], 2)
+        state = self.load(mem)
+
+        # Breakpoint predicates indexed by address, and their conditions
+        breakpoints = [None] * 256
+        conditions = {}
+
+        # Watchpoints are devices that wrap the memory-mapped I/O
+        watchpoints = {}
+        hits = []
 
-        breakpoints = []
         quiet = False
+        history = History(self)
 
         while True:
             # Print current instruction
-            bin = mem['code'][state.regs[15]][0]
+            pc = state.regs[15]
 
             if quiet:
-                next = copy.deepcopy(self.execute(bin, state))
-                if next.regs[15] == state.regs[15] or next.regs[15] in breakpoints:
+                history.record(state, self.rom[pc])
+                self.step(state)
+                npc = state.regs[15]
+                if npc == pc or hits or (breakpoints[npc] is not None and breakpoints[npc](state)):
                     quiet = False
-                state = next
                 continue
 
-            _, dis = self.disassembler.process(bin)
+            for hit in hits:
+                print('watchpoint: ' + hit)
+            hits.clear()
+
+            _, dis = self.disassembler.process(self.code[pc])
+            bin = f'{self.code[pc]:017b}'
             print(f'{state.regs[15]:3}: {bin[0:4]} {bin[4]} {bin[5:9]} {bin[9:13]} {bin[13:17]} ({dis})')
 
-            next = copy.deepcopy(state)
+            # Only keep a snapshot when the difference is printed
+            prev = state.copy()
 
             # Present interface
             cmd = input('>> ').strip()
             if cmd == '' or cmd == 'n':
                 # Advance to next instruction
-                next = self.execute(bin, state)
+                history.record(state, self.rom[pc])
+                self.step(state)
             elif cmd == 'c':
                 # Execute continuously
                 quiet = True
             elif cmd[0] == 'b':
                 # Set (or clear) breakpoint
                 try:
-                    line = int(cmd[2:], 0)
-                    if line in breakpoints:
-                        breakpoints.remove(line)
+                    addr, _, cond = cmd[2:].partition(' if ')
+                    addr = int(addr, 0)&255
+                    if cond.strip():
+                        breakpoints[addr] = condition(cond)
+                        conditions[addr] = cond.strip()
+                    elif addr in conditions:
+                        breakpoints[addr] = None
+                        del conditions[addr]
+                    else:
+                        breakpoints[addr] = lambda state: True
+                        conditions[addr] = ''
+                    print('breakpoints: ', ', '.join(f'{a} if {c}' if c else str(a) for a, c in sorted(conditions.items())))
+                except Exception as e:
+                    print(e)
+            elif cmd[0] == 'w':
+                # Set (or clear) watchpoint
+                try:
+                    kind, _, addr = cmd.partition(' ')
+                    if kind not in ('w', 'wr', 'wa'):
+                        raise ValueError(f'Unknown command {kind}')
+                    addr = int(addr, 0)&255
+                    reads, writes = kind != 'w', kind != 'wr'
+                    if addr in watchpoints:
+                        watchpoint = watchpoints[addr]
+                        if (watchpoint.reads, watchpoint.writes) == (reads, writes):
+                            self.attach(addr, watchpoints.pop(addr).device)
+                        else:
+                            watchpoint.reads, watchpoint.writes = reads, writes
                     else:
-                        breakpoints.append(line)
-                    print('breakpoints: ', breakpoints)
+                        watchpoints[addr] = Watchpoint(self.io[addr], hits, reads, writes)
+                        self.attach(addr, watchpoints[addr])
+                    print('watchpoints: ', ', '.join(f'{a} ({"r" if w.reads else ""}{"w" if w.writes else ""})' for a, w in sorted(watchpoints.items())))
                 except Exception as e:
                     print(e)
             elif cmd == 'p':
                 # Print current state
                 print(state)
             elif cmd == 'q':
-                # Exit simulator
+                # Exit simulator, restoring watched devices
+                for addr, watchpoint in watchpoints.items():
+                    self.attach(addr, watchpoint.device)
                 return
+            elif cmd == 'rs' or cmd.startswith('rs '):
+                # Reverse step
+                try:
+                    n = int(cmd[2:], 0) if cmd[2:].strip() else 1
+                    for i in range(n):
+                        if not history.reverse(state):
+                            print('start of history')
+                            break
+                except Exception as e:
+                    print(e)
+            elif cmd == 'rc':
+                # Reverse continuously
+                while history.reverse(state):
+                    bp = breakpoints[state.regs[15]]
+                    if bp is not None and bp(state):
+                        break
+                else:
+                    print('start of history')
             elif cmd[0] == 'r':
                 # Set register
                 tokens = [t.strip() for t in cmd.split('=')]
@@ -239,7 +549,7 @@ class Simulator:
                         print(e)
                 elif len(tokens) == 2:
                     try:
-                        next.regs[int(tokens[0][1:])] = int(tokens[1], 0)&255
+                        state.regs[int(tokens[0][1:])] = int(tokens[1], 0)&255
                     except Exception as e:
                         print(e)
                 else:
@@ -256,7 +566,7 @@ class Simulator:
                         print(e)
                 elif len(tokens) == 2:
                     try:
-                        next.mem[int(tokens[0][1:-1])] = int(tokens[1], 0)&255
+                        state.mem[int(tokens[0][1:-1])] = int(tokens[1], 0)&255
                     except Exception as e:
                         print(e)
                 else:
@@ -265,19 +575,34 @@ class Simulator:
                 self.help()
 
             # Print resulting difference
-            diff = state.diff(next)
+            diff = prev.diff(state)
             if diff != '':
                 print('     ' + diff)
-            state = copy.deepcopy(next)
 
-    def run(self, mem, steps=1000):
-        """Simulate machine code for a set number of steps and return PC."""
-        state = State()
-        for i, c in enumerate(mem['data']):
-            state.mem[i] = int(c[0], 2)
+    def simulate(self, mem, steps=1000, halt=True, pcs=(), until=None):
+        """Simulate machine code until a stop condition is met.
 
-        for s in range(steps):
-            bin = mem['code'][state.regs[15]][0]
-            state = copy.deepcopy(self.execute(bin, state))
+        Stops when the step budget is exhausted ('steps'), when a branch
+        jumps to itself ('halt', if enabled), when the PC reaches an address
+        in pcs ('pc'), or when until(state) returns True ('until').
+        Returns the final state, number of cycles executed and the reason."""
+        state = self.load(mem)
+        regs = state.regs
+        rom = self.rom
+        pcs = set(pcs)
 
-        return state.regs[15]
+        for cycle in range(1, steps+1):
+            pc = regs[15]
+            self.step(state)
+            if regs[15] == pc and halt and B <= rom[pc].op <= BGE:
+                return Result(state, cycle, 'halt')
+            if regs[15] in pcs:
+                return Result(state, cycle, 'pc')
+            if until is not None and until(state):
+                return Result(state, cycle, 'until')
+
+        return Result(state, steps, 'steps')
+
+    def run(self, mem, steps=1000):
+        """Simulate machine code for a set number of steps and return PC."""
+        return self.simulate(mem, steps).state.regs[15]
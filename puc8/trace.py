@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+"""Execution traces for ENG1448 8-bit processor simulator
+   (c) 2020-2023 Wouter Caarls, PUC-Rio
+
+A trace starts with an 8-byte header, the magic 'PUC8TRC' followed by a
+version byte, and then contains one record per executed instruction:
+
+    pc, info, (reg, value) * nregs, (addr, value) * nmem
+
+where the low nibble of info holds the flags after execution (zero,
+carry, negative, overflow from bit 0 upwards), bits 4-5 hold nregs and
+bits 6-7 hold nmem. Writes to the PC are not recorded; they are implied
+by the next record. Stores to I/O devices are only recorded if the device
+kept the value in data memory. Traces may be compressed with gzip, bz2 or lzma.
+"""
+
+import sys, gzip, bz2, lzma, argparse
+from collections import namedtuple
+from itertools import zip_longest
+
+from .simulator import LDR, STR, MOV, PUSH, CALL, POP, ADD
+
+MAGIC = b'PUC8TRC'
+VERSION = 1
+
+Step = namedtuple('Step', ['pc', 'flags', 'regs', 'mem'])
+
+_openers = {'gz': gzip.open, 'bz2': bz2.open, 'xz': lzma.open}
+
+def _open(file, mode, compress=None):
+    """Opens a trace file, compressing according to compress or the file extension."""
+    if compress is None:
+        compress = file.rsplit('.', 1)[-1]
+    return _openers.get(compress, open)(file, mode)
+
+class TraceWriter:
+    """Records executed instructions and their register and memory writes."""
+    def __init__(self, file, compress=None):
+        self.f = _open(file, 'wb', compress)
+        self.f.write(MAGIC + bytes([VERSION]))
+        self.buffer = bytearray()
+
+    def record(self, pc, inst, state):
+        """Records the execution of an instruction at pc, given the state after execution."""
+        regs = state.regs
+        m = inst.op
+        rd = inst.rd
+        buffer = self.buffer
+        info = state.zero | state.carry << 1 | state.negative << 2 | state.overflow << 3
+
+        if m == LDR or m == MOV or m >= ADD:
+            if rd != 15:
+                buffer += bytes((pc, info | 1 << 4, rd, regs[rd]))
+            else:
+                buffer += bytes((pc, info))
+        elif m == POP:
+            if rd != 15 and rd != 14:
+                buffer += bytes((pc, info | 2 << 4, rd, regs[rd], 14, regs[14]))
+            else:
+                buffer += bytes((pc, info | 1 << 4, 14, regs[14]))
+        elif m == PUSH or m == CALL:
+            addr = (regs[14] + 1)&255
+            buffer += bytes((pc, info | 1 << 4 | 1 << 6, 14, regs[14], addr, state.mem[addr]))
+        elif m == STR:
+            # Only the PC may have changed
+            a = pc if inst.rs == 15 else regs[inst.rs]
+            addr = inst.c8 if inst.imm else (a + inst.c4i)&255
+            value = pc if rd == 15 else regs[rd]
+            if state.mem[addr] == value:
+                buffer += bytes((pc, info | 1 << 6, addr, value))
+            else:
+                # Store went to a device instead of memory
+                buffer += bytes((pc, info))
+        else:
+            buffer += bytes((pc, info))
+
+        if len(buffer) > 65536:
+            self.flush()
+
+    def flush(self):
+        self.f.write(self.buffer)
+        self.buffer = bytearray()
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+class TraceReader:
+    """Lazily iterates over the records of a trace."""
+    def __init__(self, file):
+        self.file = file
+
+    def __iter__(self):
+        with open(self.file, 'rb') as f:
+            head = f.read(6)
+        if head[:2] == b'\x1f\x8b':
+            opener = gzip.open
+        elif head[:3] == b'BZh':
+            opener = bz2.open
+        elif head == b'\xfd7zXZ\x00':
+            opener = lzma.open
+        else:
+            opener = open
+
+        with opener(self.file, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{self.file} is not a PUC8 trace')
+            if f.read(1)[0] != VERSION:
+                raise ValueError(f'{self.file} has an unsupported trace version')
+
+            data = b''
+            pos = 0
+            while True:
+                if len(data) - pos < 14:
+                    # Make sure a complete record is available
+                    data = data[pos:] + f.read(65536)
+                    pos = 0
+                    if len(data) == 0:
+                        return
+                    if len(data) < 2:
+                        raise ValueError(f'{self.file} is truncated')
+                pc, info = data[pos], data[pos+1]
+                nregs, nmem = info >> 4 & 3, info >> 6
+                pos += 2
+                regs = tuple(zip(data[pos:pos+2*nregs:2], data[pos+1:pos+2*nregs:2]))
+                pos += 2*nregs
+                mem = tuple(zip(data[pos:pos+2*nmem:2], data[pos+1:pos+2*nmem:2]))
+                pos += 2*nmem
+                if pos > len(data):
+                    raise ValueError(f'{self.file} is truncated')
+                yield Step(pc, info & 15, regs, mem)
+
+def compare(file1, file2):
+    """Returns the index of the first step at which two traces differ,
+    or None if they are identical."""
+    for step, (a, b) in enumerate(zip_longest(TraceReader(file1), TraceReader(file2))):
+        if a != b:
+            return step
+    return None
+
+def main():
+    parser = argparse.ArgumentParser(description='PUC8 trace comparison (c) 2020-2023 Wouter Caarls, PUC-Rio')
+    parser.add_argument('file', type=str, nargs=2,
+                        help='Trace files')
+
+    args = parser.parse_args()
+
+    step = compare(*args.file)
+    if step is None:
+        print('Traces are identical')
+        return
+
+    print(f'Traces diverge at step {step}:')
+    for file in args.file:
+        for s, rec in enumerate(TraceReader(file)):
+            if s == step:
+                print(f'  {file}: {rec}')
+                break
+        else:
+            print(f'  {file}: <end of trace>')
+    sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+"""Vectorized simulator for ENG1448 8-bit processor
+   (c) 2020-2023 Wouter Caarls, PUC-Rio
+"""
+
+import numpy as np
+
+from .image import Image
+from .devices import ADDR_KDR, ADDR_LDR, ADDR_LCR
+from .simulator import (decode, ILL, LDR, STR, MOV, B, BZ, BNZ, BCS, BCC, BLT, BGE,
+                        PUSH, CALL, POP, ADD, SUB, SHL, SHR, AND, ORR, EOR)
+
+# Fault codes for instances that stopped on an error
+OK, STACK_OVERFLOW, STACK_UNDERFLOW, ILLEGAL_INSTRUCTION = range(4)
+
+class VectorState:
+    """Machine state for N simulator instances."""
+    def __init__(self, n):
+        self.regs = np.zeros((n, 16), dtype=np.uint8)
+        self.mem = np.zeros((n, 256), dtype=np.uint8)
+        self.regs[:, 14] = 255
+        self.zero = np.zeros(n, dtype=bool)
+        self.carry = np.zeros(n, dtype=bool)
+        self.negative = np.zeros(n, dtype=bool)
+        self.overflow = np.zeros(n, dtype=bool)
+        self.halted = np.zeros(n, dtype=bool)
+        self.fault = np.zeros(n, dtype=np.uint8)
+        self.cycles = np.zeros(n, dtype=np.int64)
+        self.output = ['' for i in range(n)]
+
+    def __len__(self):
+        return len(self.regs)
+
+class VectorSimulator:
+    """Simulates machine code for many instances in lock step.
+
+    Every instance has its own registers, memory and PC, and may run its
+    own program. Results are identical to those of Simulator.execute, except
+    that I/O is not simulated through devices. The device model is fixed:
+    the keyboard register reads as 0, LCD output is collected in
+    VectorState.output instead of being printed, and all other I/O
+    registers behave as plain memory."""
+    def __init__(self):
+        self.prog = np.zeros(0, dtype=np.intp)
+
+    def load(self, mems, n=1):
+        """Decodes one program per instance (or a single program for n
+        instances) and returns the initial machine state."""
+        if isinstance(mems, Image):
+            mems = [mems] * n
+
+        # Decode each distinct program only once
+        programs = {}
+        prog = []
+        for mem in mems:
+            prog.append(programs.setdefault(id(mem), len(programs)))
+        rom = np.zeros((len(programs), 256, 8), dtype=np.int32)
+        rom[:] = decode(0)
+        data = np.zeros((len(programs), 256), dtype=np.uint8)
+        for mem in mems:
+            p = programs[id(mem)]
+            for addr, word in enumerate(mem.code[:256]):
+                rom[p, addr] = decode(word)
+            data[p, :min(len(mem.data), 256)] = list(mem.data[:256])
+
+        self.prog = np.array(prog, dtype=np.intp)
+        (self.op, self.rd, self.rs, self.rt,
+         self.c4i, self.c4, self.c8, self.imm) = np.moveaxis(rom, 2, 0)
+
+        state = VectorState(len(mems))
+        state.mem[:] = data[self.prog]
+        return state
+
+    def step(self, state):
+        """Executes one instruction on every instance that has not halted."""
+        idx = np.flatnonzero(~state.halted)
+        if len(idx) == 0:
+            return
+
+        regs = state.regs
+        mem = state.mem
+        prog = self.prog[idx]
+        pc = regs[idx, 15].astype(np.int32)
+
+        m = self.op[prog, pc]
+        r1 = self.rd[prog, pc]
+        r2 = self.rs[prog, pc]
+        c4i = self.c4i[prog, pc]
+        c4 = self.c4[prog, pc]
+        c8 = self.c8[prog, pc]
+        imm = self.imm[prog, pc].astype(bool)
+
+        # Read operands before the PC is incremented
+        d = regs[idx, r1].astype(np.int32)
+        a = regs[idx, r2].astype(np.int32)
+        sp = regs[idx, 14].astype(np.int32)
+        addr = np.where(imm, c8, (a + c4i)&255)
+        val = np.where(imm, np.where(m < AND, c4, 1<<c4), regs[idx, self.rt[prog, pc]])
+        nextpc = (pc + 1)&255
+
+        # Faulting instances stop without changing state
+        fault = np.zeros(len(idx), dtype=np.uint8)
+        fault[((m == PUSH) | (m == CALL)) & (sp == 0)] = STACK_OVERFLOW
+        fault[(m == POP) & (sp == 255)] = STACK_UNDERFLOW
+        fault[m == ILL] = ILLEGAL_INSTRUCTION
+        if fault.any():
+            f = fault != 0
+            state.fault[idx[f]] = fault[f]
+            state.halted[idx[f]] = True
+            keep = ~f
+            idx, m, r1, r2, c4i, c8, imm, d, a, sp, addr, val, pc, nextpc = (
+                x[keep] for x in (idx, m, r1, r2, c4i, c8, imm, d, a, sp, addr, val, pc, nextpc))
+
+        regs[idx, 15] = nextpc
+        state.cycles[idx] += 1
+
+        # Register results
+        ldr = m == LDR
+        mov = m == MOV
+        pop = m == POP
+        alu = m >= ADD
+        res = np.where(mov, np.where(imm, c8, a), mem[idx, addr])
+        res = np.where(ldr & (addr == ADDR_KDR), 0, res)
+        res = np.where(pop, mem[idx, (sp + 1)&255], res)
+        res = np.where(m == ADD, a + val, res)
+        res = np.where(m == SUB, a + (256 - val), res)
+        res = np.where(m == SHL, a << 1, res)
+        res = np.where(m == SHR, a >> 1, res)
+        res = np.where(m == AND, a & val, res)
+        res = np.where(m == ORR, a | val, res)
+        res = np.where(m == EOR, a ^ val, res)
+
+        w = ldr | mov | pop | alu
+        regs[idx[w], r1[w]] = res[w]&255
+
+        # Flags
+        f = mov | alu
+        fi = idx[f]
+        state.zero[fi] = (res[f]&255) == 0
+        state.carry[fi] = (res[f] & 256) != 0
+        state.negative[fi] = (res[f] & 128) != 0
+        ovf = np.where(m == ADD, ~(a ^ val) & (a ^ res), 0)
+        ovf = np.where(m == SUB, (a ^ val) & (a ^ res), ovf)
+        state.overflow[fi] = (ovf[f] & 128) != 0
+
+        # Stack pointer
+        s = (m == PUSH) | (m == CALL)
+        regs[idx[s], 14] = sp[s] - 1
+        regs[idx[pop], 14] = (regs[idx[pop], 14].astype(np.int32) + 1)&255
+
+        # Memory writes
+        st = m == STR
+        lcd = st & ((addr == ADDR_LDR) | ((addr == ADDR_LCR) & (d == 1)))
+        for i in np.flatnonzero(lcd):
+            state.output[idx[i]] += chr(d[i]) if addr[i] == ADDR_LDR else '\n'
+        st &= ~lcd
+        mem[idx[st], addr[st]] = d[st]
+        push = m == PUSH
+        mem[idx[push], sp[push]] = d[push]
+        call = m == CALL
+        mem[idx[call], sp[call]] = nextpc[call]
+
+        # Jumps
+        zero = state.zero[idx]
+        carry = state.carry[idx]
+        less = state.overflow[idx] != state.negative[idx]
+        taken = ((m == B) | ((m == BZ) & zero) | ((m == BNZ) & ~zero) |
+                 ((m == BCS) & carry) | ((m == BCC) & ~carry) |
+                 ((m == BLT) & less) | ((m == BGE) & ~less))
+        target = np.where(imm, c8, (np.where(r2 == 15, nextpc, a) + c4i)&255)
+        target = np.where(call, np.where(imm, c8, a), target)
+        j = taken | call
+        regs[idx[j], 15] = target[j]
+
+        # A branch to itself halts the instance
+        state.halted[idx[taken & (target == pc)]] = True
+
+    def run(self, state, steps=1000):
+        """Simulates until all instances have halted or the step budget is
+        exhausted. Returns the number of steps taken."""
+        for s in range(steps):
+            if state.halted.all():
+                return s
+            self.step(state)
+        return steps
@@ -26,7 +26,9 @@ setup(name='puc8',
       keywords='assembler compiler educational risc processor',
       packages=find_packages(),
       package_data={'': ['*.grammar']},
+      extras_require={'vector': ['numpy']},
       entry_points = {
         'console_scripts': ['as-puc8=puc8.asm:main',
-                            'cc-puc8=puc8.cc:main']
+                            'cc-puc8=puc8.cc:main',
+                            'dis-puc8=puc8.dis:main']
       })